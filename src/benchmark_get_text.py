@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Text extraction benchmark on theses PDFs from static/thesis/texts
+#
+#   python benchmark_get_text.py [--legacy] [files ...]
+#
+# For every PDF prints number of pages, time of get_text() and time per page.
+# Time per page of the streaming get_text() doesn't grow with the size of
+# document. With --legacy the previous implementation (whole text is
+# normalized again after each page) is timed too and its result is
+# compared with get_text().
+
+import os
+import re
+import sys
+import time
+
+import fitz
+
+from flask_se_theses import get_text
+
+texts_dir = "static/thesis/texts"
+
+
+def get_text_legacy(filename):
+    doc = fitz.open(filename)
+    text = ""
+
+    for current_page in range(3, len(doc)):
+        page = doc.load_page(current_page)
+        text += page.get_text("text").lower() + "\n"
+        text = text.replace("-\n", "")
+        text = re.sub(r"[^a-z а-я \n : / . () # - ]", "", text)
+
+    return text
+
+
+def timed(function, filename):
+    start = time.perf_counter()
+    result = function(filename)
+    return result, time.perf_counter() - start
+
+
+def report(rows, title):
+    # rows: (pages, seconds), grouped by size of document
+    print("\n" + title)
+    print("%12s %8s %12s %14s" % ("pages", "files", "total, s", "per page, ms"))
+
+    for low, high in [(0, 25), (25, 50), (50, 100), (100, 10000)]:
+        group = [(p, t) for p, t in rows if low <= p < high]
+        pages = sum(p for p, t in group)
+
+        if not pages:
+            continue
+
+        seconds = sum(t for p, t in group)
+        print(
+            "%12s %8d %12.2f %14.2f"
+            % ("%d-%d" % (low, high), len(group), seconds, seconds / pages * 1000)
+        )
+
+
+def main():
+    legacy = "--legacy" in sys.argv
+    files = [arg for arg in sys.argv[1:] if arg != "--legacy"]
+
+    if not files:
+        files = [
+            os.path.join(texts_dir, name)
+            for name in sorted(os.listdir(texts_dir))
+            if name.endswith(".pdf")
+        ]
+
+    rows = []
+    legacy_rows = []
+    mismatch = 0
+
+    for filename in files:
+        try:
+            with fitz.open(filename) as doc:
+                pages = max(len(doc) - 3, 0)
+        except Exception as err:
+            print("%s: %s" % (filename, err))
+            continue
+
+        text, seconds = timed(get_text, filename)
+        rows.append((pages, seconds))
+
+        if legacy:
+            legacy_text, legacy_seconds = timed(get_text_legacy, filename)
+            legacy_rows.append((pages, legacy_seconds))
+
+            if legacy_text != text:
+                mismatch = mismatch + 1
+                print("%s: result differs from legacy get_text" % filename)
+
+            print(
+                "%-70s %5d pages %8.3f s %8.3f s (legacy)"
+                % (os.path.basename(filename)[:70], pages, seconds, legacy_seconds)
+            )
+        else:
+            print(
+                "%-70s %5d pages %8.3f s"
+                % (os.path.basename(filename)[:70], pages, seconds)
+            )
+
+    report(rows, "get_text")
+
+    if legacy:
+        report(legacy_rows, "legacy get_text")
+        print("\nDifferent results: %d of %d" % (mismatch, len(rows)))
+
+
+if __name__ == "__main__":
+    main()
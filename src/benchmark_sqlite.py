@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+# Concurrency benchmark of SQLite settings
+#
+#   python benchmark_sqlite.py [seconds] [readers] [writers]
+#
+# Reader and writer processes work with a scratch database (like uwsgi
+# workers with counters, votes and mail jobs). Every writer transaction keeps
+# the write lock for a few milliseconds. The run is made twice: with default
+# settings (rollback journal) and with SQLITE_PRAGMAS from flask_se_config.
+# For readers the latency of a query and the number of "database is locked"
+# errors are printed. With WAL readers are not blocked by the writers.
+#
+# The third run goes through an SQLAlchemy engine with the engine options of
+# the site (QueuePool, pragmas set by the connect event of se_models). The
+# engine is used in the parent before the processes are forked, like the
+# uwsgi master loading the application, and every process runs THREADS
+# threads (uwsgi "threads"). Connections a process got from its parent are
+# printed, the pool must be empty after fork.
+
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from threading import Thread
+
+from sqlalchemy import create_engine
+
+from flask_se_config import DATABASE_URL, SQLITE_PRAGMAS
+
+ROWS = 20000
+WRITE_HOLD = 0.005
+THREADS = 2
+
+engine = None
+
+
+def connect(file_name, pragmas):
+    connection = sqlite3.connect(file_name, timeout=5, isolation_level=None)
+
+    for name, value in pragmas:
+        connection.execute("PRAGMA {0} = {1}".format(name, value))
+
+    return connection
+
+
+def create_database(file_name, pragmas):
+    connection = connect(file_name, pragmas)
+    connection.execute(
+        "CREATE TABLE thesis (id INTEGER PRIMARY KEY, year INTEGER, downloads INTEGER)"
+    )
+    connection.executemany(
+        "INSERT INTO thesis (year, downloads) VALUES (?, 0)",
+        [(2010 + i % 13,) for i in range(ROWS)],
+    )
+    connection.close()
+
+
+def reader(file_name, pragmas, seconds, results):
+    connection = connect(file_name, pragmas)
+    latencies = []
+    errors = 0
+    stop = time.monotonic() + seconds
+
+    while time.monotonic() < stop:
+        start = time.perf_counter()
+
+        try:
+            connection.execute(
+                "SELECT id, downloads FROM thesis WHERE year = ? "
+                "ORDER BY id DESC LIMIT 10",
+                (2010 + len(latencies) % 13,),
+            ).fetchall()
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            errors = errors + 1
+
+    results.put(("read", latencies, errors))
+
+
+def writer(file_name, pragmas, seconds, results):
+    connection = connect(file_name, pragmas)
+    writes = 0
+    errors = 0
+    stop = time.monotonic() + seconds
+
+    while time.monotonic() < stop:
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE thesis SET downloads = downloads + 1 WHERE id = ?",
+                (writes % ROWS + 1,),
+            )
+            time.sleep(WRITE_HOLD)
+            connection.execute("COMMIT")
+            writes = writes + 1
+        except sqlite3.OperationalError:
+            errors = errors + 1
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+
+    results.put(("write", writes, errors))
+
+
+def engine_reader(seconds, results):
+    latencies = []
+    errors = 0
+    stop = time.monotonic() + seconds
+
+    while time.monotonic() < stop:
+        start = time.perf_counter()
+
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql(
+                    "SELECT id, downloads FROM thesis WHERE year = ? "
+                    "ORDER BY id DESC LIMIT 10",
+                    (2010 + len(latencies) % 13,),
+                ).fetchall()
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors = errors + 1
+
+    results.append(("read", latencies, errors))
+
+
+def engine_writer(seconds, results):
+    writes = 0
+    errors = 0
+    stop = time.monotonic() + seconds
+
+    while time.monotonic() < stop:
+        try:
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "UPDATE thesis SET downloads = downloads + 1 WHERE id = ?",
+                    (writes % ROWS + 1,),
+                )
+                time.sleep(WRITE_HOLD)
+            writes = writes + 1
+        except Exception:
+            errors = errors + 1
+
+    results.append(("write", writes, errors))
+
+
+def engine_process(target, seconds, results):
+    inherited = engine.pool.checkedin() + engine.pool.checkedout()
+    thread_results = []
+    threads = [
+        Thread(target=target, args=(seconds, thread_results)) for i in range(THREADS)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    for kind, value, errors in thread_results:
+        results.put((kind, value, errors))
+
+    results.put(("inherited", inherited, 0))
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(title, pragmas, seconds, readers, writers):
+    directory = tempfile.mkdtemp()
+    file_name = os.path.join(directory, "bench.db")
+    create_database(file_name, pragmas)
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=reader, args=(file_name, pragmas, seconds, results)
+        )
+        for i in range(readers)
+    ] + [
+        multiprocessing.Process(
+            target=writer, args=(file_name, pragmas, seconds, results)
+        )
+        for i in range(writers)
+    ]
+
+    report(title, seconds, processes, len(processes), results)
+
+
+def run_engine(title, seconds, readers, writers):
+    global engine
+
+    # Engine options and the connect event of the site
+    from flask_se import app
+
+    directory = tempfile.mkdtemp()
+    file_name = os.path.join(directory, "bench.db")
+    create_database(file_name, SQLITE_PRAGMAS)
+
+    engine = create_engine(
+        "sqlite:///" + file_name, **app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    )
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+    # Parent keeps a pooled connection, as the uwsgi master does
+    with engine.connect() as connection:
+        connection.exec_driver_sql("SELECT count(*) FROM thesis").fetchall()
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=engine_process, args=(engine_reader, seconds, results)
+        )
+        for i in range(readers)
+    ] + [
+        multiprocessing.Process(
+            target=engine_process, args=(engine_writer, seconds, results)
+        )
+        for i in range(writers)
+    ]
+
+    report(title, seconds, processes, len(processes) * (THREADS + 1), results)
+
+
+def report(title, seconds, processes, result_count, results):
+    for process in processes:
+        process.start()
+
+    latencies = []
+    read_errors = 0
+    writes = 0
+    write_errors = 0
+    inherited = None
+
+    for i in range(result_count):
+        kind, value, errors = results.get()
+
+        if kind == "read":
+            latencies.extend(value)
+            read_errors = read_errors + errors
+        elif kind == "write":
+            writes = writes + value
+            write_errors = write_errors + errors
+        else:
+            inherited = (inherited or 0) + value
+
+    for process in processes:
+        process.join()
+
+    print("\n" + title)
+    print(
+        "  reads: %d (%.0f/s), p50 %.2f ms, p99 %.2f ms, max %.2f ms, locked %d"
+        % (
+            len(latencies),
+            len(latencies) / seconds,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            max(latencies or [0]) * 1000,
+            read_errors,
+        )
+    )
+    print("  writes: %d (%.0f/s), locked %d" % (writes, writes / seconds, write_errors))
+
+    if inherited is not None:
+        print("  connections inherited from the parent: %d" % inherited)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+    print(
+        "%.0f s, %d readers, %d writers, write lock is held %.0f ms"
+        % (seconds, readers, writers, WRITE_HOLD * 1000)
+    )
+    run("Default settings", [], seconds, readers, writers)
+    run("SQLITE_PRAGMAS", SQLITE_PRAGMAS, seconds, readers, writers)
+
+    if DATABASE_URL:
+        print("\nEngine of the site is not SQLite (DATABASE_URL), skipped")
+    else:
+        run_engine(
+            "Engine of the site, %d threads per process" % THREADS,
+            seconds,
+            readers,
+            writers,
+        )
+
+
+if __name__ == "__main__":
+    main()
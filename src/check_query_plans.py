@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+# Check that hot queries of the site use indexes
+#
+#   python check_query_plans.py
+#
+# Runs EXPLAIN QUERY PLAN for the queries of theses, diplomas, practice,
+# review and news pages on the application database and prints the plans.
+# A lookup fails the check unless the table it filters is searched by an
+# index ("SEARCH table USING INDEX ..."), any "SCAN table" is a failure,
+# even "SCAN table USING INDEX" which walks the whole index. An ordered read
+# without a filter (first page of news) fails if its rows are sorted ("USE
+# TEMP B-TREE FOR ORDER BY") instead of being read in the order of an
+# index. Exit status is 1 if any query fails, e.g. when migrations are not
+# applied ("flask db upgrade"). The check is done for SQLite only:
+# PostgreSQL scans small tables even with indexes.
+
+import sys
+
+from sqlalchemy import desc, func
+
+from flask_se import app
+from se_models import (
+    db,
+    is_postgresql,
+    CurrentThesis,
+    DiplomaThemes,
+    Notification,
+    NotificationPractice,
+    Posts,
+    Thesis,
+    ThesisOnReview,
+    ThesisReport,
+)
+
+db.app = app
+db.init_app(app)
+
+
+def hot_queries():
+    """(name, table, query) where table is the one which must be searched by
+    an index. Queries are the same as in the views."""
+    return [
+        (
+            "theses list",
+            "thesis",
+            Thesis.query.filter(Thesis.temporary == False)
+            .filter(Thesis.publish_year >= 2007)
+            .filter(Thesis.publish_year <= 2022)
+            .order_by(Thesis.publish_year.desc(), Thesis.id.desc())
+            .limit(10),
+        ),
+        (
+            "theses by supervisor",
+            "thesis",
+            Thesis.query.filter(Thesis.temporary == False).filter(
+                Thesis.supervisor_id == 1
+            ),
+        ),
+        (
+            "theses by course",
+            "thesis",
+            Thesis.query.filter(Thesis.course_id == 1),
+        ),
+        (
+            "theses by worktype",
+            "thesis",
+            Thesis.query.filter(Thesis.type_id == 2),
+        ),
+        (
+            "theses on moderation",
+            "thesis",
+            Thesis.query.filter_by(temporary=True).filter_by(review_status=10),
+        ),
+        (
+            "theses worktype facet",
+            "thesis",
+            db.session.query(Thesis.type_id, func.count(Thesis.id))
+            .filter(Thesis.temporary == False)
+            .group_by(Thesis.type_id),
+        ),
+        (
+            "theses years facet",
+            "thesis",
+            db.session.query(Thesis.publish_year)
+            .filter(Thesis.temporary == False)
+            .distinct()
+            .order_by(Thesis.publish_year.desc()),
+        ),
+        (
+            "approved diploma themes",
+            "diploma_themes",
+            DiplomaThemes.query.filter(DiplomaThemes.status == 2)
+            .order_by(DiplomaThemes.id.desc())
+            .limit(10),
+        ),
+        (
+            "diploma themes of author",
+            "diploma_themes",
+            DiplomaThemes.query.filter_by(author_id=1),
+        ),
+        (
+            "diploma themes of supervisor",
+            "diploma_themes",
+            DiplomaThemes.query.filter(DiplomaThemes.status == 2).filter(
+                DiplomaThemes.supervisor_id == 1
+            ),
+        ),
+        (
+            "practice notifications",
+            "notification_practice",
+            NotificationPractice.query.filter_by(recipient_id=1)
+            .filter_by(viewed=False)
+            .order_by(desc(NotificationPractice.time)),
+        ),
+        (
+            "practices of student",
+            "current_thesis",
+            CurrentThesis.query.filter_by(author_id=1),
+        ),
+        (
+            "practices of supervisor",
+            "current_thesis",
+            CurrentThesis.query.filter_by(supervisor_id=1)
+            .filter_by(status=1)
+            .filter_by(deleted=False),
+        ),
+        (
+            "practices of area and worktype",
+            "current_thesis",
+            CurrentThesis.query.filter_by(status=1)
+            .filter_by(deleted=False)
+            .filter_by(area_id=1)
+            .filter_by(worktype_id=2),
+        ),
+        (
+            "practice reports",
+            "thesis_report",
+            ThesisReport.query.filter_by(current_thesis_id=1)
+            .filter_by(deleted=False)
+            .order_by(desc(ThesisReport.time)),
+        ),
+        (
+            "theses on review",
+            "thesis_on_review",
+            ThesisOnReview.query.filter(ThesisOnReview.review_status == 1)
+            .filter(ThesisOnReview.deleted == 0)
+            .order_by(ThesisOnReview.id.desc())
+            .limit(10),
+        ),
+        (
+            "news rank window",
+            "posts",
+            Posts.query.filter(Posts.created_on >= "2026-01-01"),
+        ),
+        (
+            "mail notifications of recipient",
+            "notification",
+            Notification.query.filter(Notification.recipient == 1),
+        ),
+        (
+            "mail notifications of lease owner",
+            "notification",
+            Notification.query.filter_by(lease_owner="owner", status=1),
+        ),
+    ]
+
+
+def ordered_queries():
+    """(name, table, query) where rows of table must be read in the order of
+    an index."""
+    return [
+        (
+            "news",
+            "posts",
+            Posts.query.order_by(Posts.rank.desc()).limit(10),
+        ),
+    ]
+
+
+def query_plan(query):
+    statement = query.statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    return [
+        row[-1] for row in db.session.execute("EXPLAIN QUERY PLAN " + str(statement))
+    ]
+
+
+def index_search(plan, table):
+    # "SEARCH thesis USING INDEX ix_... (course_id=?)" or "USING COVERING
+    # INDEX", "SCAN thesis" reads every row of the table or of an index
+    searched = False
+
+    for line in plan:
+        words = line.split()
+
+        if len(words) < 2 or words[1] != table:
+            continue
+
+        if words[0] == "SCAN":
+            return False
+
+        if words[0] == "SEARCH" and (
+            words[2:4] == ["USING", "INDEX"]
+            or words[2:5] == ["USING", "COVERING", "INDEX"]
+        ):
+            searched = True
+
+    return searched
+
+
+def index_order(plan, table):
+    # "SCAN posts USING INDEX ix_posts_rank" without "USE TEMP B-TREE FOR
+    # ORDER BY"
+    for line in plan:
+        words = line.split()
+
+        if line.startswith("USE TEMP B-TREE FOR") and "ORDER BY" in line:
+            return False
+
+        if len(words) >= 2 and words[1] == table and "INDEX" not in words:
+            return False
+
+    return True
+
+
+def main():
+    if is_postgresql():
+        sys.exit("Query plans are checked for SQLite database only")
+
+    checks = [(query, index_search) for query in hot_queries()] + [
+        (query, index_order) for query in ordered_queries()
+    ]
+    failed = 0
+
+    for (name, table, query), check in checks:
+        plan = query_plan(query)
+        ok = check(plan, table)
+
+        if not ok:
+            failed = failed + 1
+
+        print("%-4s %s" % ("ok" if ok else "FAIL", name))
+        for line in plan:
+            print("       " + line)
+
+    print("\nFailed: %d of %d queries" % (failed, len(checks)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+# Check mail notifications against a local SMTP server
+#
+#   pip install aiosmtpd
+#   python check_sendmail.py
+#
+# aiosmtpd runs an SMTP server on localhost which accepts the login of
+# MAIL_DEFAULT_SENDER with MAIL_PASSWORD and keeps the messages in memory.
+# Notifications of a temporary SQLite database are sent through it by
+# notification_send_mail, the application database is not used. Exit status
+# is 1 if any check fails.
+
+import os
+import smtplib
+import socket
+import sys
+import tempfile
+from email import message_from_bytes
+from email.policy import default
+
+try:
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+except ImportError:
+    sys.exit("aiosmtpd is required: pip install aiosmtpd")
+
+import se_sendmail
+from flask_se import app
+from se_models import db, Notification, Users
+from se_sendmail import MailSender, make_message, notification_send_mail
+
+HOST = "127.0.0.1"
+
+database = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + database.name
+
+db.app = app
+db.init_app(app)
+
+
+class Handler:
+    def __init__(self, login, password):
+        self.login = login
+        self.password = password
+        self.messages = []
+        self.logins = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted"
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        self.logins = self.logins + 1
+        # Not handled: the server answers 535 to a refused login
+        return AuthResult(
+            success=auth_data.login.decode() == self.login
+            and auth_data.password.decode() == self.password,
+            handled=False,
+        )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def add_notifications(recipients):
+    """A notification to each of recipients, emails of users."""
+    users = {user.email: user for user in Users.query.all()}
+
+    for i, email in enumerate(recipients):
+        if email not in users:
+            users[email] = Users(email=email, first_name="Test")
+            db.session.add(users[email])
+            db.session.flush()
+
+        db.session.add(
+            Notification(
+                recipient=users[email].id,
+                title="[SE site] Notification %d" % i,
+                content="Text %d" % i,
+            )
+        )
+
+    db.session.commit()
+
+
+def clear(handler):
+    # Like the end of a job: sent notifications are deleted by a query, the
+    # session must not keep them
+    Notification.query.delete()
+    db.session.commit()
+    db.session.remove()
+    handler.messages.clear()
+    handler.logins = 0
+
+
+def digests(handler, port):
+    def run():
+        add_notifications(["a@example.com", "a@example.com", "b@example.com"])
+        notification_send_mail(HOST, port)
+
+        recipients = sorted(rcpt for m in handler.messages for rcpt in m.rcpt_tos)
+        subjects = [
+            message_from_bytes(m.content, policy=default)["Subject"]
+            for m in handler.messages
+        ]
+        left = Notification.query.count()
+
+        assert recipients == ["a@example.com", "b@example.com"], recipients
+        assert "[SE site] Новые уведомления (2)" in subjects, subjects
+        assert left == 0, "%d notifications left" % left
+        assert handler.logins == 1, "%d logins" % handler.logins
+
+        return "%d messages, one login" % len(handler.messages)
+
+    return run
+
+
+def reconnect(handler, port):
+    def run():
+        per_connection = se_sendmail.MAIL_MESSAGES_PER_CONNECTION
+        se_sendmail.MAIL_MESSAGES_PER_CONNECTION = 2
+
+        try:
+            with MailSender(HOST, port) as sender:
+                for i in range(5):
+                    message = make_message("Message %d" % i, "Text", "a@example.com")
+                    sender.send("a@example.com", message)
+
+                # The connection is dropped
+                sender.server.sock.shutdown(socket.SHUT_RDWR)
+                sender.send("a@example.com", message)
+        finally:
+            se_sendmail.MAIL_MESSAGES_PER_CONNECTION = per_connection
+
+        assert len(handler.messages) == 6, "%d messages" % len(handler.messages)
+        assert handler.logins == 4, "%d logins" % handler.logins
+
+        return "6 messages over %d connections" % handler.logins
+
+    return run
+
+
+def refused_login(handler, port):
+    def run():
+        add_notifications(["a@example.com"])
+        password = se_sendmail.MAIL_PASSWORD
+        se_sendmail.MAIL_PASSWORD = password + "wrong"
+
+        try:
+            notification_send_mail(HOST, port)
+            raised = None
+        except smtplib.SMTPAuthenticationError as err:
+            raised = err
+        finally:
+            se_sendmail.MAIL_PASSWORD = password
+
+        n = Notification.query.one()
+
+        assert raised is not None, "no SMTPAuthenticationError"
+        assert not handler.messages, "%d messages" % len(handler.messages)
+        assert (n.status, n.attempts) == (0, 0), "status %d" % n.status
+
+        return "raised %d, notification is waiting" % raised.smtp_code
+
+    return run
+
+
+def server_down(handler, port):
+    def run():
+        add_notifications(["a@example.com"])
+
+        try:
+            notification_send_mail(HOST, free_port())
+            raised = None
+        except OSError as err:
+            raised = err
+
+        n = Notification.query.one()
+
+        assert raised is not None, "no OSError"
+        assert (n.status, n.attempts) == (0, 0), "status %d" % n.status
+
+        return "raised %s, notification is waiting" % type(raised).__name__
+
+    return run
+
+
+def checks(handler, port):
+    """(name, function) where function sends mail, checks what the server got
+    and returns a description of the result."""
+    return [
+        ("digest to each recipient", digests(handler, port)),
+        ("reconnect", reconnect(handler, port)),
+        ("refused login", refused_login(handler, port)),
+        ("server is down", server_down(handler, port)),
+    ]
+
+
+def main():
+    db.create_all()
+
+    handler = Handler(se_sendmail.MAIL_DEFAULT_SENDER, se_sendmail.MAIL_PASSWORD)
+    port = free_port()
+    controller = Controller(
+        handler,
+        hostname=HOST,
+        port=port,
+        authenticator=handler.authenticate,
+        auth_require_tls=False,
+    )
+    controller.start()
+
+    print("SMTP server: %s:%d\n" % (HOST, port))
+
+    failed = 0
+
+    try:
+        for name, run in checks(handler, port):
+            try:
+                result = run()
+                ok = True
+            except Exception as err:
+                result = str(err).splitlines()[0] if str(err) else repr(err)
+                ok = False
+
+            db.session.rollback()
+            clear(handler)
+
+            if not ok:
+                failed = failed + 1
+
+            print("%-4s %s" % ("ok" if ok else "FAIL", name))
+            print("       " + result)
+    finally:
+        controller.stop()
+        db.session.remove()
+        os.remove(database.name)
+
+    print("\nFailed: %d of %d checks" % (failed, len(checks(handler, port))))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
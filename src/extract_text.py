@@ -1,19 +1,186 @@
-import requests
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Extract text of theses files into thesis_text (search index).
+#
+#   python extract_text.py [--all] [--workers N] [--batch N]
+#
+# Only new and changed files are processed: a file is skipped if its size and
+# mtime are the same as stored in thesis_text, or if its SHA-1 is the same
+# (file was copied or touched). --all extracts text of every file again.
+# Files are processed in a process pool, results are committed in batches.
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from flask_se import app
-from se_models import db, Thesis
+from se_models import db, Thesis, ThesisText
 from flask_se_theses import get_text
 
 db.app = app
 db.init_app(app)
 
-thesises = Thesis.query.all()
-
-for thesis in thesises:
-    if thesis.text_uri is not None:
-        file_name = "static/thesis/texts/" + thesis.text_uri
-        if (
-            file_name[file_name.rfind(".") + 1 :] == "pdf"
-            or file_name[file_name.rfind(".") + 1 :] == "doc"
-        ):
-            thesis.text = get_text(file_name)
-            db.session.commit()
+texts_dir = "static/thesis/texts/"
+text_extensions = ["pdf", "doc"]
+
+
+def file_sha1(file_name):
+    sha1 = hashlib.sha1()
+
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def extract_file(file_name, known_sha1):
+    """Runs in a worker process. Returns (sha1, text), text is None if the
+    file content is the same as known_sha1."""
+    sha1 = file_sha1(file_name)
+
+    if sha1 == known_sha1:
+        return sha1, None
+
+    return sha1, get_text(file_name)
+
+
+def find_changed(force):
+    """List of (thesis_id, file_name, size, mtime, stored sha1) to process."""
+    records = (
+        db.session.query(
+            Thesis.id,
+            Thesis.text_uri,
+            ThesisText.file_size,
+            ThesisText.file_mtime,
+            ThesisText.file_sha1,
+        )
+        .outerjoin(ThesisText, ThesisText.thesis_id == Thesis.id)
+        .filter(Thesis.text_uri.isnot(None))
+        .order_by(Thesis.id)
+    )
+
+    changed = []
+    skipped = 0
+    missing = 0
+
+    for thesis_id, text_uri, size, mtime, sha1 in records:
+        if text_uri[text_uri.rfind(".") + 1 :] not in text_extensions:
+            continue
+
+        file_name = texts_dir + text_uri
+
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            missing = missing + 1
+            continue
+
+        if not force and size == stat.st_size and mtime == stat.st_mtime:
+            skipped = skipped + 1
+            continue
+
+        changed.append(
+            (thesis_id, file_name, stat.st_size, stat.st_mtime, None if force else sha1)
+        )
+
+    return changed, skipped, missing
+
+
+def save_text(thesis_id, size, mtime, sha1, text):
+    record = ThesisText.query.get(thesis_id)
+
+    if not record:
+        record = ThesisText(thesis_id=thesis_id)
+        db.session.add(record)
+
+    # text is None when content of the file is not changed
+    if text is not None:
+        record.text = text
+
+    record.file_size = size
+    record.file_mtime = mtime
+    record.file_sha1 = sha1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract text of theses files")
+    parser.add_argument(
+        "--all", action="store_true", help="extract text of all files again"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    parser.add_argument("--batch", type=int, default=50, help="theses per commit")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    changed, skipped, missing = find_changed(args.all)
+
+    print(
+        "Files to process: %d, not changed: %d, missing: %d"
+        % (len(changed), skipped, missing)
+    )
+
+    extracted = 0
+    unchanged = 0
+    failed = 0
+    processed_bytes = 0
+    pending = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(extract_file, file_name, sha1): (
+                thesis_id,
+                file_name,
+                size,
+                mtime,
+            )
+            for thesis_id, file_name, size, mtime, sha1 in changed
+        }
+
+        for future in as_completed(futures):
+            thesis_id, file_name, size, mtime = futures[future]
+
+            try:
+                sha1, text = future.result()
+            except Exception as err:
+                failed = failed + 1
+                print("%s: %s" % (file_name, err), file=sys.stderr)
+                continue
+
+            save_text(thesis_id, size, mtime, sha1, text)
+            processed_bytes = processed_bytes + size
+
+            if text is None:
+                unchanged = unchanged + 1
+            else:
+                extracted = extracted + 1
+
+            pending = pending + 1
+            if pending >= args.batch:
+                db.session.commit()
+                pending = 0
+
+    db.session.commit()
+
+    elapsed = time.perf_counter() - start
+    print(
+        "Extracted: %d, same content: %d, failed: %d" % (extracted, unchanged, failed)
+    )
+    print(
+        "Time: %.1f s, %.1f files/s, %.1f MB/s"
+        % (
+            elapsed,
+            (extracted + unchanged) / elapsed,
+            processed_bytes / elapsed / 1024 / 1024,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
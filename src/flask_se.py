@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 from datetime import datetime
 import tzlocal
@@ -12,28 +13,44 @@ from flask_apscheduler import APScheduler
 from flask_frozen import Freezer
 from flask_migrate import Migrate
 from flaskext.markdown import Markdown
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql.expression import func
 from flask_simplemde import SimpleMDE
 from flask_login import current_user
 
 
 import flask_se_theses
+from se_jobs import record_job_stats, run_jobs, start_jobs_if_leader
+from se_page_cache import cached_page
+from se_reference import (
+    areas_of_study,
+    courses,
+    post_types,
+    thesis_on_review_worktypes,
+    worktypes,
+)
+from se_search import create_search_index
 from flask_se_config import (
     SECRET_KEY_THESIS,
     SECRET_KEY,
     SQLITE_DATABASE_NAME,
     SQLITE_DATABASE_PATH,
+    SQLITE_POOL_SIZE,
+    SQLITE_MAX_OVERFLOW,
+    DATABASE_URL,
+    POSTGRES_POOL_SIZE,
+    POSTGRES_MAX_OVERFLOW,
+    POSTGRES_POOL_RECYCLE,
+    JOBS_IN_WEB_WORKERS,
     plural_hours,
     get_hours_since,
 )
 from se_models import (
     db,
-    search,
     init_db,
     Staff,
     Users,
     Thesis,
-    Curriculum,
     SummerSchool,
     Posts,
     DiplomaThemes,
@@ -152,9 +169,33 @@ app.config["FREEZER_DESTINATION"] = "../docs"
 app.config["FREEZER_IGNORE_MIMETYPE_WARNINGS"] = True
 
 # SQLAlchimy config
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    "sqlite:///" + SQLITE_DATABASE_PATH + SQLITE_DATABASE_NAME
-)
+if DATABASE_URL:
+    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": POSTGRES_POOL_SIZE,
+        "max_overflow": POSTGRES_MAX_OVERFLOW,
+        "pool_recycle": POSTGRES_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        # Naive datetimes of the site are UTC
+        "connect_args": {"options": "-c timezone=utc"},
+    }
+else:
+    app.config["SQLALCHEMY_DATABASE_URI"] = (
+        "sqlite:///" + SQLITE_DATABASE_PATH + SQLITE_DATABASE_NAME
+    )
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "poolclass": QueuePool,
+        "pool_size": SQLITE_POOL_SIZE,
+        "max_overflow": SQLITE_MAX_OVERFLOW,
+        "connect_args": {"check_same_thread": False},
+    }
+
+# uwsgi forks workers after the application is loaded, a child must not use
+# pooled connections of the parent: an SQLite connection shared by processes
+# corrupts locks of the database, a PostgreSQL connection is a socket. The
+# child drops the pool without closing the connections of the parent
+os.register_at_fork(after_in_child=lambda: db.get_engine(app).dispose(close=False))
+
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = True
 app.config["SECRET_KEY"] = SECRET_KEY
 app.config["SESSION_COOKIE_NAME"] = "se_session"
@@ -190,10 +231,18 @@ app.add_url_rule("/fetch_theses", view_func=flask_se_theses.fetch_theses)
 app.add_url_rule(
     "/post_theses", methods=["GET", "POST"], view_func=flask_se_theses.post_theses
 )
+app.add_url_rule(
+    "/post_theses_status",
+    methods=["GET", "POST"],
+    view_func=flask_se_theses.post_theses_status,
+)
 app.add_url_rule("/theses_tmp.html", view_func=flask_se_theses.theses_tmp)
 app.add_url_rule("/theses_delete_tmp", view_func=flask_se_theses.theses_delete_tmp)
 app.add_url_rule("/theses_add_tmp", view_func=flask_se_theses.theses_add_tmp)
 app.add_url_rule("/thesis_download", view_func=flask_se_theses.download_thesis)
+app.add_url_rule(
+    "/presentation_download", view_func=flask_se_theses.download_presentation
+)
 
 
 # News
@@ -355,14 +404,6 @@ app.add_url_rule(
 db.app = app
 db.init_app(app)
 
-app.config["MSEARCH_BACKEND"] = "whoosh"
-app.config["MSEARCH_ENABLE"] = True
-search.init_app(app)
-# search.create_index(Thesis, update=True)
-# search.create_index(Users, update=True)
-# search.create_index(Thesis, update=True)
-# search.create_index(Users, update=True)
-
 # Init Migrate
 migrate = Migrate(app, db, render_as_batch=True)
 
@@ -402,7 +443,20 @@ scheduler.add_job(
     trigger="interval",
     seconds=86400,
 )
-scheduler.start()
+scheduler.add_job(
+    id="ProcessThesisUploads",
+    func=flask_se_theses.process_thesis_uploads,
+    trigger="interval",
+    seconds=5,
+)
+record_job_stats(scheduler)
+
+if JOBS_IN_WEB_WORKERS:
+    # Scripts importing the app don't serve requests and don't run jobs
+    @app.before_request
+    def start_jobs():
+        start_jobs_if_leader(scheduler)
+
 
 # Init Flask-admin
 admin = Admin(app, index_view=SeAdminIndexView(), template_mode="bootstrap4")
@@ -431,6 +485,17 @@ app.config["SIMPLEMDE_USE_CDN"] = False
 SimpleMDE(app)
 
 
+# Reference tables are read by templates from memory (se_reference), e.g.
+# {{ post_types.get(n.type_id) }} instead of a lazy load of n.type per post
+app.jinja_env.globals.update(
+    areas_of_study=areas_of_study,
+    courses=courses,
+    post_types=post_types,
+    thesis_on_review_worktypes=thesis_on_review_worktypes,
+    worktypes=worktypes,
+)
+
+
 @app.template_filter("datatime_convert")
 def datetime_convert(value, format="%d.%m.%Y %H:%M"):
     return value.replace(tzinfo=pytz.UTC).astimezone(tz.tzlocal()).strftime(format)
@@ -438,6 +503,7 @@ def datetime_convert(value, format="%d.%m.%Y %H:%M"):
 
 # Flask routes goes
 @app.route("/")
+@cached_page(["posts", "post_type"])
 def index():
     ages = []
     news = (
@@ -491,74 +557,12 @@ def bachelor_application():
 
 @app.route("/bachelor/programming-technology.html")
 def bachelor_programming_technology():
-    curricula1 = (
-        Curriculum.query.filter(Curriculum.course_id == 1)
-        .filter(Curriculum.study_year == 1)
-        .order_by(Curriculum.type)
-        .all()
-    )
-    curricula2 = (
-        Curriculum.query.filter(Curriculum.course_id == 1)
-        .filter(Curriculum.study_year == 2)
-        .order_by(Curriculum.type)
-        .all()
-    )
-    curricula3 = (
-        Curriculum.query.filter(Curriculum.course_id == 1)
-        .filter(Curriculum.study_year == 3)
-        .order_by(Curriculum.type)
-        .all()
-    )
-    curricula4 = (
-        Curriculum.query.filter(Curriculum.course_id == 1)
-        .filter(Curriculum.study_year == 4)
-        .order_by(Curriculum.type)
-        .all()
-    )
-
-    return render_template(
-        "bachelor_programming-technology.html",
-        curricula1=curricula1,
-        curricula2=curricula2,
-        curricula3=curricula3,
-        curricula4=curricula4,
-    )
+    return render_template("bachelor_programming-technology.html")
 
 
 @app.route("/bachelor/software-engineering.html")
 def bachelor_software_engineering():
-    curricula1 = (
-        Curriculum.query.filter(Curriculum.course_id == 2)
-        .filter(Curriculum.study_year == 1)
-        .order_by(Curriculum.type)
-        .all()
-    )
-    curricula2 = (
-        Curriculum.query.filter(Curriculum.course_id == 2)
-        .filter(Curriculum.study_year == 2)
-        .order_by(Curriculum.type)
-        .all()
-    )
-    curricula3 = (
-        Curriculum.query.filter(Curriculum.course_id == 2)
-        .filter(Curriculum.study_year == 3)
-        .order_by(Curriculum.type)
-        .all()
-    )
-    curricula4 = (
-        Curriculum.query.filter(Curriculum.course_id == 2)
-        .filter(Curriculum.study_year == 4)
-        .order_by(Curriculum.type)
-        .all()
-    )
-
-    return render_template(
-        "bachelor_software-engineering.html",
-        curricula1=curricula1,
-        curricula2=curricula2,
-        curricula3=curricula3,
-        curricula4=curricula4,
-    )
+    return render_template("bachelor_software-engineering.html")
 
 
 @app.route("/master/information-systems-administration.html")
@@ -572,6 +576,7 @@ def master_software_engineering():
 
 
 @app.route("/department/staff.html")
+@cached_page(["staff", "users"])
 def department_staff():
     records = Staff.query.filter_by(still_working=True).all()
     staff = []
@@ -596,6 +601,7 @@ def department_staff():
 
 
 @app.route("/bachelor/admission.html")
+@cached_page(["thesis", "staff", "users", "courses", "tag", "tags"])
 def bachelor_admission():
     students = []
 
@@ -621,12 +627,14 @@ def nooffer():
 
 
 @app.route("/summer_school_2021.html")
+@cached_page(["summer_school"])
 def summer_school():
     projects = SummerSchool.query.filter_by(year=2021).all()
     return render_template("summer_school.html", projects=projects)
 
 
 @app.route("/summer_school_2022.html")
+@cached_page(["summer_school"])
 def summer_school_2022():
     projects = SummerSchool.query.filter_by(year=2022).all()
     return render_template("summer_school_2022.html", projects=projects)
@@ -644,6 +652,7 @@ def sitemap():
         "/sitemap.xml",
         "/404.html",
         "/post_theses",
+        "/post_theses_status",
         "/theses_tmp.html",
         "/theses_delete_tmp",
         "/theses_add_tmp",
@@ -675,5 +684,11 @@ if __name__ == "__main__":
             freezer.freeze()
         elif sys.argv[1] == "init":
             init_db()
+        elif sys.argv[1] == "search_index":
+            create_search_index()
+        elif sys.argv[1] == "post_rank":
+            recalculate_post_rank(window=None)
+        elif sys.argv[1] == "jobs":
+            run_jobs(scheduler)
     else:
         app.run(port=5000, debug=True)
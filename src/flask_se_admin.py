@@ -29,7 +29,8 @@ class SeAdminModelView(ModelView):
 
 
 class SeAdminModelViewThesis(SeAdminModelView):
-    column_exclude_list = ["text"]
+    column_exclude_list = ["text_record"]
+    form_excluded_columns = ["text_record"]
     pass
 
 
@@ -22,9 +22,11 @@ import google.auth.transport.requests
 from google.oauth2 import id_token
 from pip._vendor import cachecontrol
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from flask_se_config import secure_filename
+from se_cache import TableCache
 from se_models import db, Users
 
 # Global variables
@@ -38,6 +40,9 @@ login_manager.login_view = "login_index"
 # create an alias of login_required decorator
 login_required = login_required
 
+USER_CACHE_TTL = 30
+user_cache = TableCache(dict, ["users", "staff", "reviewer"], ttl=USER_CACHE_TTL)
+
 
 # Google auth (https://github.com/code-specialist/flask_google_login/blob/main/app.py)
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
@@ -48,9 +53,37 @@ GOOGLE_CLIENT_ID = (
 client_secrets_file = os.path.join(pathlib.Path(__file__).parent, "client_google.json")
 
 
+def query_user(session, user_id):
+    """User with staff and reviewer records, one query."""
+    return (
+        session.query(Users)
+        .options(joinedload(Users.staff), joinedload(Users.reviewer))
+        .filter(Users.id == user_id)
+        .first()
+    )
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return Users.query.get(int(user_id))
+    """Current user, Flask-Login keeps it for the rest of the request.
+
+    Users are also kept in user_cache for USER_CACHE_TTL seconds (dropped on
+    commit to users, staff or reviewer in any process). Cached users are
+    detached, a request gets its own copy attached by merge() without a query.
+    The only query of a cached user is the read of change stamps, done once
+    per request for all caches (se_models.data_version).
+    """
+    user = user_cache.lookup(int(user_id), load_cached_user)
+
+    if user is None:
+        return None
+
+    return db.session.merge(user, load=False)
+
+
+def load_cached_user(user_id):
+    with Session(db.engine) as session:
+        return query_user(session, user_id)
 
 
 @login_manager.unauthorized_handler
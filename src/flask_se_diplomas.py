@@ -7,9 +7,22 @@ from flask_login import current_user
 
 from flask_se_auth import login_required
 from se_forms import UserAddTheme, UserEditTheme, DiplomaThemesFilter
-from se_models import db, DiplomaThemes, ThemesLevel, Company, Staff, Users
-
-
+from se_models import db, DiplomaThemes, ThemesLevel, Staff, Users
+from se_page_cache import cached_page
+from se_pagination import keyset_paginate
+from se_reference import companies, themes_levels
+
+# Tables of the public list of themes
+DIPLOMA_THEMES_TABLES = [
+    "diploma_themes",
+    "diploma_themes_level",
+    "themes_level",
+    "company",
+    "users",
+]
+
+
+@cached_page(DIPLOMA_THEMES_TABLES)
 def diplomas_index():
     diploma_filter = DiplomaThemesFilter()
 
@@ -22,7 +35,7 @@ def diplomas_index():
         .distinct()
         .all()
     ):
-        company = Company.query.filter_by(id=sid[0]).first()
+        company = companies.get(sid[0])
         diploma_filter.company.choices.append((sid[0], company.name))
         diploma_filter.company.choices.sort(key=lambda tup: tup[1])
 
@@ -54,7 +67,7 @@ def diplomas_index():
         diploma_filter.supervisor.choices.append((sid[0], last_name + " " + initials))
         diploma_filter.supervisor.choices.sort(key=lambda tup: tup[1])
 
-    for sid in ThemesLevel.query.all():
+    for sid in themes_levels.all():
         diploma_filter.level.choices.append((sid.id, sid.level))
         diploma_filter.level.choices.sort(key=lambda tup: tup[1])
 
@@ -73,11 +86,14 @@ def diplomas_index():
     )
 
 
+@cached_page(DIPLOMA_THEMES_TABLES)
 def fetch_themes():
     level = request.args.get("level", default=0, type=int)
     page = request.args.get("page", default=1, type=int)
     supervisor = request.args.get("supervisor", default=0, type=int)
     company = request.args.get("company", default=0, type=int)
+    cursor = request.args.get("cursor", default=None, type=str)
+    with_total = request.args.get("total", default=0, type=int)
 
     if company:
         # Check if company exists
@@ -104,8 +120,15 @@ def fetch_themes():
             supervisor = 0
 
     if level:
-        records = records.filter(DiplomaThemes.levels.any(id=level)).paginate(
-            per_page=10, page=page, error_out=False
+        records = records.filter(DiplomaThemes.levels.any(id=level))
+
+    if cursor is not None:
+        records = keyset_paginate(
+            records,
+            [(DiplomaThemes.id, True)],
+            cursor,
+            per_page=10,
+            with_total=with_total,
         )
     else:
         records = records.paginate(per_page=10, page=page, error_out=False)
@@ -153,11 +176,9 @@ def get_theme():
 def add_user_theme():
     user = current_user
     add_theme = UserAddTheme()
-    add_theme.levels.choices = [
-        (g.id, g.level) for g in ThemesLevel.query.order_by("id").all()
-    ]
+    add_theme.levels.choices = [(g.id, g.level) for g in themes_levels.all()]
     add_theme.company.choices = [
-        (g.id, g.name) for g in Company.query.filter_by(status=0).order_by("id")
+        (g.id, g.name) for g in companies.all() if g.status == 0
     ]
 
     if request.method == "POST":
@@ -185,18 +206,16 @@ def add_user_theme():
             flash("Необходимо указать, от кого предлагается тема.")
             return render_template("diplomas/add_theme.html", form=add_theme, user=user)
 
-        themes_level = ThemesLevel.query.all()
-        company_count = Company.query.count()
-
-        for tl in themes_level:
-            if tl.id in levels:
-                level_accepted.append(tl)
+        # Levels are checked in memory, only the chosen ones are loaded
+        for level_id in sorted(set(levels)):
+            if level_id in themes_levels:
+                level_accepted.append(db.session.get(ThemesLevel, level_id))
 
         if not level_accepted:
             flash("Уровень темы указан неверно")
             return render_template("diplomas/add_theme.html", form=add_theme, user=user)
 
-        if company < 1 or company > company_count:
+        if company not in companies:
             flash("Уровень темы указан неверно")
             return render_template("diplomas/add_theme.html", form=add_theme, user=user)
 
@@ -250,10 +269,8 @@ def edit_user_theme():
         return redirect(url_for("diplomas_index"))
 
     edit_theme = UserEditTheme()
-    edit_theme.levels.choices = [
-        (g.id, g.level) for g in ThemesLevel.query.order_by("id")
-    ]
-    edit_theme.company.choices = [(g.id, g.name) for g in Company.query.order_by("id")]
+    edit_theme.levels.choices = [(g.id, g.level) for g in themes_levels.all()]
+    edit_theme.company.choices = [(g.id, g.name) for g in companies.all()]
     edit_theme.levels.data = [c.id for c in theme.levels]
     edit_theme.company.data = str(theme.company_id)
     edit_theme.comment.data = theme.comment
@@ -297,12 +314,10 @@ def edit_user_theme():
                 "diplomas/edit_theme.html", form=edit_theme, user=user
             )
 
-        themes_level = ThemesLevel.query.all()
-        company_count = Company.query.count()
-
-        for tl in themes_level:
-            if tl.id in levels:
-                level_accepted.append(tl)
+        # Levels are checked in memory, only the chosen ones are loaded
+        for level_id in sorted(set(levels)):
+            if level_id in themes_levels:
+                level_accepted.append(db.session.get(ThemesLevel, level_id))
 
         if not level_accepted:
             flash("Уровень темы указан неверно")
@@ -310,7 +325,7 @@ def edit_user_theme():
                 "diplomas/add_theme.html", form=edit_theme, user=user
             )
 
-        if company < 1 or company > company_count:
+        if company not in companies:
             flash("Уровень темы указан неверно")
             return render_template(
                 "diplomas/edit_theme.html", form=edit_theme, user=user
@@ -15,18 +15,33 @@ from se_models import (
     InternshipCompany,
     InternshipTag,
 )
-
-
+from se_page_cache import conditional_page
+from se_pagination import keyset_paginate
+from se_reference import internship_companies, internship_formats, internship_tags
+
+# Tables of the list of internships
+INTERNSHIPS_TABLES = [
+    "internships",
+    "internships_format",
+    "internships_tag",
+    "internship_format",
+    "internship_tag",
+    "internship_company",
+    "users",
+]
+
+
+@conditional_page(INTERNSHIPS_TABLES)
 def internships_index():
     internship_filter = InternshipsFilter()
 
     user = current_user
     for x in Internships.query.with_entities(Internships.company_id).distinct().all():
-        company = InternshipCompany.query.filter_by(id=x[0]).first()
+        company = internship_companies.get(x[0])
         internship_filter.company.choices.append((x[0], company.name))
         internship_filter.company.choices.sort(key=lambda tup: tup[1])
 
-    for sid in InternshipFormat.query.all():
+    for sid in internship_formats.all():
         internship_filter.format.choices.append((sid.id, sid.format))
 
     internship_filter.tag.choices = sorted(
@@ -54,15 +69,11 @@ def old_internships_index():
 def add_internship():
     user = current_user
     add_intern = AddInternship()
-    add_intern.format.choices = [
-        (g.id, g.format) for g in InternshipFormat.query.order_by("id").all()
-    ]
+    add_intern.format.choices = [(g.id, g.format) for g in internship_formats.all()]
     add_intern.tag.choices = [
-        (t.id, t.tag) for t in InternshipTag.query.order_by("tag").all()
-    ]
-    add_intern.company.choices = [
-        g.name for g in InternshipCompany.query.order_by("id")
+        (t.id, t.tag) for t in sorted(internship_tags.all(), key=lambda t: t.tag)
     ]
+    add_intern.company.choices = [g.name for g in internship_companies.all()]
 
     if request.method == "POST":
         name_vacancy = request.form.get("name_vacancy", type=str)
@@ -103,10 +114,10 @@ def add_internship():
         list_of_tags = list(map(lambda x: x.strip(), tags.rstrip(",").split(",")))
         for t in list_of_tags:
             is_finded = False
-            for posb_tag in InternshipTag.query.all():
+            for posb_tag in internship_tags.all():
                 if posb_tag.tag.upper() == t.upper():
                     is_finded = True
-                    tag_list.append(posb_tag)
+                    tag_list.append(db.session.get(InternshipTag, posb_tag.id))
                     break
             if not is_finded:
                 flash(
@@ -120,11 +131,9 @@ def add_internship():
 
         format_list = []
 
-        int_format = InternshipFormat.query.all()
-
-        for f in int_format:
+        for f in internship_formats.all():
             if f.id in format:
-                format_list.append(f)
+                format_list.append(db.session.get(InternshipFormat, f.id))
 
         if not db.session.query(InternshipCompany.id).filter_by(name=company).scalar():
             company_entity = InternshipCompany(name=company)
@@ -199,19 +208,13 @@ def update_internship(id):
         return redirect(url_for("internships_index"))
     upd_internship = AddInternship(obj=internship)
 
-    upd_internship.format.choices = [
-        (g.id, g.format) for g in InternshipFormat.query.order_by("id").all()
-    ]
-    upd_internship.tag.choices = [
-        (t.id, t.tag) for t in InternshipTag.query.order_by("id").all()
-    ]
+    upd_internship.format.choices = [(g.id, g.format) for g in internship_formats.all()]
+    upd_internship.tag.choices = [(t.id, t.tag) for t in internship_tags.all()]
     upd_internship.tag.data = "".join([t.tag + ", " for t in internship.tag]).strip(
         ", "
     )
     upd_internship.format.data = [c.id for c in internship.format]
-    upd_internship.company.choices = [
-        g.name for g in InternshipCompany.query.order_by("id")
-    ]
+    upd_internship.company.choices = [g.name for g in internship_companies.all()]
 
     if request.method == "POST":
         name_vacancy = request.form.get("name_vacancy", type=str)
@@ -264,10 +267,10 @@ def update_internship(id):
         list_of_tags = list(map(lambda x: x.strip(), tags.rstrip(",").split(",")))
         for t in list_of_tags:
             is_finded = False
-            for posb_tag in InternshipTag.query.all():
+            for posb_tag in internship_tags.all():
                 if posb_tag.tag.upper() == t.upper():
                     is_finded = True
-                    tag_list.append(posb_tag)
+                    tag_list.append(db.session.get(InternshipTag, posb_tag.id))
                     break
             if not is_finded:
                 flash(
@@ -284,11 +287,9 @@ def update_internship(id):
 
         format_list = []
 
-        int_format = InternshipFormat.query.all()
-
-        for f in int_format:
+        for f in internship_formats.all():
             if f.id in format:
-                format_list.append(f)
+                format_list.append(db.session.get(InternshipFormat, f.id))
 
         if not db.session.query(InternshipCompany.id).filter_by(name=company).scalar():
             company_entity = InternshipCompany(name=company)
@@ -319,6 +320,7 @@ def update_internship(id):
         )
 
 
+@conditional_page(INTERNSHIPS_TABLES)
 def fetch_internships():
     user = current_user
 
@@ -326,6 +328,8 @@ def fetch_internships():
     page = request.args.get("page", default=1, type=int)
     company = request.args.get("company", default=0, type=int)
     tag = request.args.get("tag", default=0, type=int)
+    cursor = request.args.get("cursor", default=None, type=str)
+    with_total = request.args.get("total", default=0, type=int)
 
     if company:
         records = Internships.query.filter(Internships.company_id == company).order_by(
@@ -340,7 +344,16 @@ def fetch_internships():
     if tag:
         records = records.filter(Internships.tag.any(id=tag))
 
-    records = records.paginate(per_page=10, page=page, error_out=False)
+    if cursor is not None:
+        records = keyset_paginate(
+            records,
+            [(Internships.id, True)],
+            cursor,
+            per_page=10,
+            with_total=with_total,
+        )
+    else:
+        records = records.paginate(per_page=10, page=page, error_out=False)
 
     if len(records.items):
         return render_template(
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import textile
+from functools import partial
 from urllib.parse import urlparse
 
 from flask import flash, redirect, request, render_template, url_for
@@ -8,9 +9,18 @@ from flask_login import current_user
 
 from flask_se_config import post_ranking_score, get_hours_since, plural_hours
 from flask_se_auth import login_required
-from se_models import db, Posts, PostVote
+from se_counters import Counter
+from se_models import db, Posts, PostVote, update_post_rank
+from se_page_cache import cached_page
 
+# Rank depends on views, it is recalculated when views are written (not
+# stamped, like the views)
+post_views = Counter(
+    Posts.views, after_flush=partial(update_post_rank, stamp_tables=False)
+)
 
+
+@cached_page(["posts", "post_type", "users"])
 def list_news():
     page = request.args.get("page", default=1, type=int)
     ages = []
@@ -33,12 +43,7 @@ def get_post():
 
     post = Posts.query.filter_by(id=post_id).first_or_404()
 
-    post.views = post.views + 1
-
-    # Recalculate rank
-    age = get_hours_since(post.created_on)
-    post.rank = post_ranking_score(post.votes, age, post.views)
-    db.session.commit()
+    post_views.increment(post.id)
 
     if post.uri:
         return redirect(post.uri)
@@ -17,10 +17,8 @@ from flask_se_config import get_thesis_type_id_string
 from se_forms import ChooseTopic, UserAddReport, CurrentWorktypeArea, AddGoal, AddTask
 from se_models import (
     Users,
-    AreasOfStudy,
     CurrentThesis,
     Staff,
-    Worktype,
     NotificationPractice,
     Deadline,
     db,
@@ -28,6 +26,7 @@ from se_models import (
     ThesisTask,
     add_mail_notification,
 )
+from se_reference import areas_of_study, worktypes
 
 from templates.practice.student.templates import PracticeStudentTemplates
 from templates.notification.templates import NotificationTemplates
@@ -137,11 +136,13 @@ def practice_new_thesis():
 
     form = CurrentWorktypeArea()
     form.area.choices.append((0, "Выберите направление"))
-    for area in AreasOfStudy.query.filter(AreasOfStudy.id > 1).order_by("id").all():
-        form.area.choices.append((area.id, area.area))
+    for area in areas_of_study.all():
+        if area.id > 1:
+            form.area.choices.append((area.id, area.area))
     form.worktype.choices.append((0, "Выберите тип работы"))
-    for worktype in Worktype.query.filter(Worktype.id > 2).all():
-        form.worktype.choices.append((worktype.id, worktype.type))
+    for worktype in worktypes.all():
+        if worktype.id > 2:
+            form.worktype.choices.append((worktype.id, worktype.type))
 
     return render_template(
         PracticeStudentTemplates.NEW_PRACTICE.value,
@@ -692,20 +693,16 @@ def practice_data_for_practice(current_thesis):
 
     form = CurrentWorktypeArea()
     form.area.choices.append((current_thesis.area_id, current_thesis.area.area))
-    for area in (
-        AreasOfStudy.query.filter(AreasOfStudy.id > 1)
-        .filter(AreasOfStudy.id != current_thesis.area.id)
-        .order_by("id")
-        .all()
-    ):
-        form.area.choices.append((area.id, area.area))
+    for area in areas_of_study.all():
+        if area.id > 1 and area.id != current_thesis.area_id:
+            form.area.choices.append((area.id, area.area))
 
     form.worktype.choices.append(
         (current_thesis.worktype_id, current_thesis.worktype.type)
     )
-    for worktype in Worktype.query.filter(Worktype.id > 2).all():
-        if worktype.id != current_thesis.worktype_id:
-            form.worktype.choices.append((worktype.id, worktype))
+    for worktype in worktypes.all():
+        if worktype.id > 2 and worktype.id != current_thesis.worktype_id:
+            form.worktype.choices.append((worktype.id, worktype.type))
 
     return render_template(
         PracticeStudentTemplates.SETTINGS.value,
@@ -11,25 +11,51 @@ from pytz import timezone
 from flask_se_auth import login_required
 from se_forms import DeadlineTemp, CurrentWorktypeArea
 from se_models import (
-    AreasOfStudy,
     CurrentThesis,
-    Worktype,
     NotificationPractice,
     Deadline,
     db,
-    add_mail_notification,
-    Staff,
+    add_mail_notifications,
 )
+from se_reference import areas_of_study, worktypes
 
 from templates.practice.admin.templates import PracticeAdminTemplates
 
 FORMAT_DATE_TIME = "%d.%m.%Y %H:%M"
 
+# Deadline field, what is announced, first word for a new and for a changed
+# deadline, mail subject
+DEADLINE_ANNOUNCEMENTS = [
+    (
+        "choose_topic",
+        "дедлайн на выбор темы",
+        "Назначен",
+        "Изменён",
+        "дедлайн на выбор темы",
+    ),
+    (
+        "submit_work_for_review",
+        "дедлайн на отправку работы для рецензирования",
+        "Назначен",
+        "Изменён",
+        "дедлайн на отправку работы на рецензирование",
+    ),
+    (
+        "upload_reviews",
+        "дедлайн на загрузку отзывов",
+        "Назначен",
+        "Изменён",
+        "дедлайн на загрузку отзывов",
+    ),
+    ("pre_defense", "время предзащиты", "Назначено", "Изменено", "время предзащиты"),
+    ("defense", "время защиты", "Назначено", "Изменено", "время защиты"),
+]
+
 
 def user_is_staff(func):
     @wraps(func)
     def check_user_is_staff_decorator():
-        user_staff = Staff.query.filter_by(user_id=current_user.id).first()
+        user_staff = current_user.get_staff()
         if not user_staff:
             return redirect(url_for("practice_index"))
         return func()
@@ -37,6 +63,22 @@ def user_is_staff(func):
     return check_user_is_staff_decorator
 
 
+def announce(recipients, title, content):
+    """In-site notification and mail to every recipient, each with one INSERT.
+
+    Content is markdown (**bold**), the mail gets it without markup. The
+    caller commits.
+    """
+    if not recipients:
+        return
+
+    db.session.execute(
+        NotificationPractice.__table__.insert(),
+        [{"recipient_id": user_id, "content": content} for user_id in recipients],
+    )
+    add_mail_notifications(recipients, title, content.replace("**", ""))
+
+
 @login_required
 @user_is_staff
 def choose_worktype_admin():
@@ -59,13 +101,13 @@ def choose_worktype_admin():
 
     form = CurrentWorktypeArea()
     form.area.choices.append((0, "Выберите направление"))
-    for area in (
-        AreasOfStudy.query.filter(AreasOfStudy.id > 1).order_by(AreasOfStudy.id).all()
-    ):
-        form.area.choices.append((area.id, area.area))
+    for area in areas_of_study.all():
+        if area.id > 1:
+            form.area.choices.append((area.id, area.area))
     form.worktype.choices.append((0, "Выберите тип работы"))
-    for worktype in Worktype.query.filter(Worktype.id > 2).all():
-        form.worktype.choices.append((worktype.id, worktype.type))
+    for worktype in worktypes.all():
+        if worktype.id > 2:
+            form.worktype.choices.append((worktype.id, worktype.type))
 
     return render_template(
         PracticeAdminTemplates.CHOOSE_WORKTYPE.value, form=form, source=source
@@ -79,8 +121,8 @@ def index_admin():
     worktype_id = request.args.get("worktype_id", type=int)
     if not area_id or not worktype_id:
         return redirect(url_for("choose_worktype_admin", source=index_admin.__name__))
-    area = AreasOfStudy.query.filter_by(id=area_id).first()
-    worktype = Worktype.query.filter_by(id=worktype_id).first()
+    area = areas_of_study.get(area_id)
+    worktype = worktypes.get(worktype_id)
 
     list_of_thesises = (
         CurrentThesis.query.filter_by(status=1)
@@ -106,8 +148,8 @@ def deadline_admin():
         return redirect(
             url_for("choose_worktype_admin", source=deadline_admin.__name__)
         )
-    area = AreasOfStudy.query.filter_by(id=area_id).first()
-    worktype = Worktype.query.filter_by(id=worktype_id).first()
+    area = areas_of_study.get(area_id)
+    worktype = worktypes.get(worktype_id)
 
     if request.method == "POST":
         worktype_id = request.form.get("worktype", type=int)
@@ -131,214 +173,55 @@ def deadline_admin():
                 deadline.area_id = area_id
                 db.session.add(deadline)
 
-            current_thesises = (
-                CurrentThesis.query.filter_by(worktype_id=worktype_id)
+            recipients = [
+                author_id
+                for (author_id,) in db.session.query(CurrentThesis.author_id)
+                .filter_by(worktype_id=worktype_id)
                 .filter_by(area_id=area_id)
                 .filter_by(deleted=False)
                 .filter_by(status=1)
-                .all()
-            )
+                .filter(CurrentThesis.author_id.isnot(None))
+            ]
+            worktype_label = worktypes.get(worktype_id).type
+            area_label = areas_of_study.get(area_id).area
+
+            for field, what, assigned, changed, subject in DEADLINE_ANNOUNCEMENTS:
+                if not request.form.get(field):
+                    continue
 
-            if request.form.get("choose_topic"):
-                new_deadline = datetime.strptime(
-                    request.form.get("choose_topic"), "%Y-%m-%dT%H:%M"
-                ).astimezone(pytz.UTC)
-                if (
-                    not deadline.choose_topic
-                    or deadline.choose_topic
-                    and deadline.choose_topic.replace(tzinfo=pytz.UTC) != new_deadline
-                ):
-                    first_word = ""
-                    if not deadline.choose_topic:
-                        first_word = "Назначен"
-                    elif deadline.choose_topic.replace(tzinfo=pytz.UTC) != new_deadline:
-                        first_word = "Изменён"
-
-                    deadline.choose_topic = new_deadline
-                    for currentThesis in current_thesises:
-                        notification = NotificationPractice()
-                        notification.recipient_id = currentThesis.author_id
-                        notification.content = (
-                            first_word
-                            + " дедлайн на выбор темы для "
-                            + Worktype.query.filter_by(id=worktype_id).first().type
-                            + " для направления "
-                            + AreasOfStudy.query.filter_by(id=area_id).first().area
-                            + ": **"
-                            + new_deadline.replace(tzinfo=pytz.UTC)
-                            .astimezone(timezone("Europe/Moscow"))
-                            .strftime(FORMAT_DATE_TIME)
-                            + " МСК**"
-                        )
-                        add_mail_notification(
-                            currentThesis.author_id,
-                            "[SE site] " + first_word + " дедлайн на выбор темы",
-                            notification.content.replace("**", ""),
-                        )
-
-                        db.session.add(notification)
-
-            if request.form.get("submit_work_for_review"):
-                new_deadline = datetime.strptime(
-                    request.form.get("submit_work_for_review"), "%Y-%m-%dT%H:%M"
-                ).astimezone(pytz.UTC)
-                if (
-                    not deadline.submit_work_for_review
-                    or deadline.submit_work_for_review
-                    and deadline.submit_work_for_review.replace(tzinfo=pytz.UTC)
-                    != new_deadline
-                ):
-                    first_word = ""
-                    if not deadline.submit_work_for_review:
-                        first_word = "Назначен"
-                    elif (
-                        deadline.submit_work_for_review.replace(tzinfo=pytz.UTC)
-                        != new_deadline
-                    ):
-                        first_word = "Изменён"
-
-                    deadline.submit_work_for_review = new_deadline
-                    for currentThesis in current_thesises:
-                        notification = NotificationPractice()
-                        notification.recipient_id = currentThesis.author_id
-                        notification.content = (
-                            first_word
-                            + " дедлайн на отправку работы для рецензирования для "
-                            + Worktype.query.filter_by(id=worktype_id).first().type
-                            + " для направления "
-                            + AreasOfStudy.query.filter_by(id=area_id).first().area
-                            + ": **"
-                            + new_deadline.replace(tzinfo=pytz.UTC)
-                            .astimezone(timezone("Europe/Moscow"))
-                            .strftime(FORMAT_DATE_TIME)
-                            + " МСК**"
-                        )
-                        add_mail_notification(
-                            currentThesis.author_id,
-                            "[SE site] "
-                            + first_word
-                            + " дедлайн на отправку работы на рецензирование",
-                            notification.content.replace("**", ""),
-                        )
-
-                        db.session.add(notification)
-
-            if request.form.get("upload_reviews"):
-                new_deadline = datetime.strptime(
-                    request.form.get("upload_reviews"), "%Y-%m-%dT%H:%M"
-                ).astimezone(pytz.UTC)
-                if (
-                    not deadline.upload_reviews
-                    or deadline.upload_reviews
-                    and deadline.upload_reviews.replace(tzinfo=pytz.UTC) != new_deadline
-                ):
-                    first_word = ""
-                    if not deadline.upload_reviews:
-                        first_word = "Назначен"
-                    elif (
-                        deadline.upload_reviews.replace(tzinfo=pytz.UTC) != new_deadline
-                    ):
-                        first_word = "Изменён"
-
-                    deadline.upload_reviews = new_deadline
-                    for currentThesis in current_thesises:
-                        notification = NotificationPractice()
-                        notification.recipient_id = currentThesis.author_id
-                        notification.content = (
-                            first_word
-                            + " дедлайн на загрузку отзывов для "
-                            + Worktype.query.filter_by(id=worktype_id).first().type
-                            + " для направления "
-                            + AreasOfStudy.query.filter_by(id=area_id).first().area
-                            + ": **"
-                            + new_deadline.replace(tzinfo=pytz.UTC)
-                            .astimezone(timezone("Europe/Moscow"))
-                            .strftime(FORMAT_DATE_TIME)
-                            + " МСК**"
-                        )
-                        add_mail_notification(
-                            currentThesis.author_id,
-                            "[SE site] " + first_word + " дедлайн на загрузку отзывов",
-                            notification.content.replace("**", ""),
-                        )
-
-                        db.session.add(notification)
-
-            if request.form.get("pre_defense"):
-                new_deadline = datetime.strptime(
-                    request.form.get("pre_defense"), "%Y-%m-%dT%H:%M"
-                ).astimezone(pytz.UTC)
-                if (
-                    not deadline.pre_defense
-                    or deadline.pre_defense
-                    and deadline.pre_defense.replace(tzinfo=pytz.UTC) != new_deadline
-                ):
-                    first_word = ""
-                    if not deadline.pre_defense:
-                        first_word = "Назначено"
-                    elif deadline.pre_defense.replace(tzinfo=pytz.UTC) != new_deadline:
-                        first_word = "Изменено"
-
-                    deadline.pre_defense = new_deadline
-                    for currentThesis in current_thesises:
-                        notification = NotificationPractice()
-                        notification.recipient_id = currentThesis.author_id
-                        notification.content = (
-                            first_word
-                            + " время предзащиты для "
-                            + Worktype.query.filter_by(id=worktype_id).first().type
-                            + " для направления "
-                            + AreasOfStudy.query.filter_by(id=area_id).first().area
-                            + ": **"
-                            + new_deadline.replace(tzinfo=pytz.UTC)
-                            .astimezone(timezone("Europe/Moscow"))
-                            .strftime(FORMAT_DATE_TIME)
-                            + " МСК**"
-                        )
-                        add_mail_notification(
-                            currentThesis.author_id,
-                            "[SE site] " + first_word + " время предзащиты",
-                            notification.content.replace("**", ""),
-                        )
-                        db.session.add(notification)
-
-            if request.form.get("defense"):
                 new_deadline = datetime.strptime(
-                    request.form.get("defense"), "%Y-%m-%dT%H:%M"
+                    request.form.get(field), "%Y-%m-%dT%H:%M"
                 ).astimezone(pytz.UTC)
+                old_deadline = getattr(deadline, field)
+
                 if (
-                    not deadline.defense
-                    or deadline.defense
-                    and deadline.defense.replace(tzinfo=pytz.UTC) != new_deadline
+                    old_deadline
+                    and old_deadline.replace(tzinfo=pytz.UTC) == new_deadline
                 ):
-                    first_word = ""
-                    if not deadline.defense:
-                        first_word = "Назначено"
-                    elif deadline.defense.replace(tzinfo=pytz.UTC) != new_deadline:
-                        first_word = "Изменено"
-
-                    deadline.defense = new_deadline
-                    for currentThesis in current_thesises:
-                        notification = NotificationPractice()
-                        notification.recipient_id = currentThesis.author_id
-                        notification.content = (
-                            first_word
-                            + " время защиты для "
-                            + Worktype.query.filter_by(id=worktype_id).first().type
-                            + " для направления "
-                            + AreasOfStudy.query.filter_by(id=area_id).first().area
-                            + ": **"
-                            + new_deadline.replace(tzinfo=pytz.UTC)
-                            .astimezone(timezone("Europe/Moscow"))
-                            .strftime(FORMAT_DATE_TIME)
-                            + " МСК**"
-                        )
-                        add_mail_notification(
-                            currentThesis.author_id,
-                            "[SE site] " + first_word + " время защиты",
-                            notification.content.replace("**", ""),
-                        )
-                        db.session.add(notification)
+                    continue
+
+                first_word = changed if old_deadline else assigned
+                setattr(deadline, field, new_deadline)
+
+                content = (
+                    first_word
+                    + " "
+                    + what
+                    + " для "
+                    + worktype_label
+                    + " для направления "
+                    + area_label
+                    + ": **"
+                    + new_deadline.replace(tzinfo=pytz.UTC)
+                    .astimezone(timezone("Europe/Moscow"))
+                    .strftime(FORMAT_DATE_TIME)
+                    + " МСК**"
+                )
+                announce(
+                    recipients,
+                    "[SE site] " + first_word + " " + subject,
+                    content,
+                )
 
             db.session.commit()
 
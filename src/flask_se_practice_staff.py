@@ -13,7 +13,6 @@ from flask_login import current_user
 from se_forms import StaffAddCommentToReport
 from se_models import (
     db,
-    Staff,
     CurrentThesis,
     ThesisReport,
     NotificationPractice,
@@ -36,7 +35,7 @@ def datetime_convert(value):
 def user_is_staff(func):
     @wraps(func)
     def check_user_is_staff_decorator():
-        user_staff = Staff.query.filter_by(user_id=current_user.id).first()
+        user_staff = current_user.get_staff()
         if not user_staff:
             return redirect(url_for("practice_index"))
         return func(user_staff)
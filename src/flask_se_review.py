@@ -4,7 +4,7 @@ import os
 from datetime import date
 from pathlib import Path
 
-from flask import flash, redirect, request, render_template, url_for
+from flask import abort, flash, redirect, request, render_template, url_for
 from flask_login import current_user
 from transliterate import translit
 
@@ -12,16 +12,17 @@ from flask_se_config import secure_filename, get_thesis_type_id_string
 from flask_se_auth import login_required
 from se_forms import AddThesisOnReview, ThesisReviewFilter, EditThesisOnReview
 from se_review_forms import ReviewForm
+from se_page_cache import conditional_page
+from se_pagination import keyset_paginate
+from se_reference import areas_of_study, thesis_on_review_worktypes
 from se_models import (
     db,
     Thesis,
     Worktype,
-    AreasOfStudy,
     Staff,
     ThesisReview,
     ThesisOnReview,
     Reviewer,
-    ThesisOnReviewWorktype,
     PromoCode,
     add_mail_notification,
 )
@@ -33,11 +34,23 @@ REVIEW_UPLOAD_FOLDER = "static/onreview/reviews/"
 ALLOWED_EXTENSIONS = {"pdf"}
 REVIEW_ROLE_LEVEL = 3
 
+# Tables of the list of theses on review, the list depends on the reviewer
+# record of the user
+THESIS_ON_REVIEW_TABLES = [
+    "thesis_on_review",
+    "thesis_on_review_worktype",
+    "areas_of_study",
+    "thesis_review",
+    "reviewer",
+    "users",
+]
+
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@conditional_page(THESIS_ON_REVIEW_TABLES)
 def thesis_review_index():
     user = current_user
     form = ThesisReviewFilter()
@@ -50,12 +63,12 @@ def thesis_review_index():
         (0, "Работа зачтена"),
     ]
 
-    for type in ThesisOnReviewWorktype.query.distinct().all():
+    for type in thesis_on_review_worktypes.all():
         form.worktype.choices.append((type.id, type.type))
 
     form.worktype.choices.sort(key=lambda tup: tup[0])
 
-    for area in AreasOfStudy.query.distinct().all():
+    for area in areas_of_study.all():
         form.areasofstudy.choices.append((area.id, area.area))
 
     form.areasofstudy.choices.sort(key=lambda tup: tup[0])
@@ -66,6 +79,7 @@ def thesis_review_index():
     )
 
 
+@conditional_page(THESIS_ON_REVIEW_TABLES)
 def fetch_thesis_on_review():
     user = current_user
 
@@ -73,6 +87,8 @@ def fetch_thesis_on_review():
     page = request.args.get("page", default=1, type=int)
     worktype = request.args.get("worktype", default=1, type=int)
     area = request.args.get("area", default=1, type=int)
+    cursor = request.args.get("cursor", default=None, type=str)
+    with_total = request.args.get("total", default=0, type=int)
 
     if status == 4:
         records = (
@@ -91,8 +107,15 @@ def fetch_thesis_on_review():
         records = records.filter(ThesisOnReview.thesis_on_review_type_id == worktype)
 
     if area > 1:
-        records = records.filter(ThesisOnReview.area_id == area).paginate(
-            per_page=20, page=page, error_out=False
+        records = records.filter(ThesisOnReview.area_id == area)
+
+    if cursor is not None:
+        records = keyset_paginate(
+            records,
+            [(ThesisOnReview.id, True)],
+            cursor,
+            per_page=20,
+            with_total=with_total,
         )
     else:
         records = records.paginate(per_page=20, page=page, error_out=False)
@@ -122,11 +145,11 @@ def submit_thesis_on_review():
             flash("Укажите название вашей работы", "error")
             return redirect(request.url)
 
-        if worktype <= 0 or worktype > ThesisOnReviewWorktype.query.distinct().count():
+        if worktype not in thesis_on_review_worktypes:
             flash("Укажите тип работы", "error")
             return redirect(request.url)
 
-        if area_of_study <= 0 or area_of_study > AreasOfStudy.query.distinct().count():
+        if area_of_study not in areas_of_study:
             flash("Укажите направление вашего обучения", "error")
             return redirect(request.url)
 
@@ -193,17 +216,15 @@ def submit_thesis_on_review():
     form.type.choices.append((0, "Тип работы"))
     form.area.choices.append((0, "Направление обучения"))
 
-    for type in (
-        ThesisOnReviewWorktype.query.filter(ThesisOnReviewWorktype.id > 1)
-        .distinct()
-        .all()
-    ):
-        form.type.choices.append((type.id, type.type))
+    for type in thesis_on_review_worktypes.all():
+        if type.id > 1:
+            form.type.choices.append((type.id, type.type))
 
     form.type.choices.sort(key=lambda tup: tup[0])
 
-    for area in AreasOfStudy.query.filter(AreasOfStudy.id > 1).distinct().all():
-        form.area.choices.append((area.id, area.area))
+    for area in areas_of_study.all():
+        if area.id > 1:
+            form.area.choices.append((area.id, area.area))
 
     form.area.choices.sort(key=lambda tup: tup[0])
 
@@ -235,11 +256,11 @@ def edit_thesis_on_review():
         title = title.strip()
         author = thesis_review.author.get_name()
 
-        if worktype <= 0 or worktype > ThesisOnReviewWorktype.query.distinct().count():
+        if worktype not in thesis_on_review_worktypes:
             flash("Укажите тип работы", "error")
             return redirect(request.url)
 
-        if area <= 0 or area > AreasOfStudy.query.distinct().count():
+        if area not in areas_of_study:
             flash("Укажите направление вашего обучения", "error")
             return redirect(request.url)
 
@@ -297,14 +318,10 @@ def edit_thesis_on_review():
 
     edit_thesis_onreview = EditThesisOnReview()
     edit_thesis_onreview.type.choices = [
-        (g.id, g.type)
-        for g in ThesisOnReviewWorktype.query.filter(
-            ThesisOnReviewWorktype.id > 1
-        ).order_by("id")
+        (g.id, g.type) for g in thesis_on_review_worktypes.all() if g.id > 1
     ]
     edit_thesis_onreview.area.choices = [
-        (g.id, g.area)
-        for g in AreasOfStudy.query.filter(AreasOfStudy.id > 1).order_by("id")
+        (g.id, g.area) for g in areas_of_study.all() if g.id > 1
     ]
 
     edit_thesis_onreview.type.default = int(thesis_review.thesis_on_review_type_id)
@@ -347,7 +364,9 @@ def delete_thesis_on_review():
 @login_required
 def review_thesis_on_review():
     user = current_user
-    user_reviewer = Reviewer.query.filter_by(user_id=user.id).first_or_404()
+    user_reviewer = user.get_reviewer()
+    if not user_reviewer:
+        abort(404)
     thesis_id = request.args.get("thesis_review_id", type=int)
     set_to_review = request.args.get("set_to_review", type=int, default=0)
 
@@ -391,7 +410,9 @@ def review_thesis_on_review():
 @login_required
 def review_submit_review():
     user = current_user
-    user_reviewer = Reviewer.query.filter_by(user_id=user.id).first_or_404()
+    user_reviewer = user.get_reviewer()
+    if not user_reviewer:
+        abort(404)
     thesis_id = request.args.get("thesis_review_id", type=int)
 
     if request.method != "POST":
@@ -575,7 +596,7 @@ def review_become_thesis_reviewer_ask():
     if not promo:
         return redirect(url_for("index"))
 
-    reviewer = Reviewer.query.filter_by(user_id=user.id).first()
+    reviewer = user.get_reviewer()
 
     if reviewer:
         return render_template("thesis_review/already_reviewer.html", user=user)
@@ -596,7 +617,7 @@ def review_become_thesis_reviewer_confirm():
     if not promo:
         return redirect(url_for("index"))
 
-    reviewer = Reviewer.query.filter_by(user_id=user.id).first()
+    reviewer = user.get_reviewer()
 
     if reviewer:
         return render_template("thesis_review/already_reviewer.html", user=user)
@@ -6,93 +6,160 @@ import os
 import random
 import re
 import fitz
+import io
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
 from os.path import splitext
 from urllib.parse import urlparse
 
 from flask import render_template, request, jsonify, redirect, url_for
+from sqlalchemy import func
 from transliterate import translit
 
 from flask_se_config import SECRET_KEY_THESIS
+from se_cache import TableCache
+from se_counters import Counter
 from se_forms import ThesisFilter
-from se_models import db, Staff, Users, Thesis, Worktype, Courses
+from se_models import db, Staff, Users, Thesis, ThesisUpload
+from se_page_cache import cached_page
+from se_pagination import keyset_paginate
+from se_reference import courses, worktypes
+from se_search import make_match_query, search_theses, search_snippets
 
 log = logging.getLogger("flask_se.sub")
 
+# Text extraction of uploaded theses runs in a separate process pool. A
+# claimed upload is returned to the queue if it is not processed in
+# THESIS_UPLOAD_LEASE_SECONDS (the process died)
+THESIS_UPLOAD_WORKERS = 2
+THESIS_UPLOAD_BATCH = 8
+THESIS_UPLOAD_LEASE_SECONDS = 600
+THESIS_UPLOAD_STATES = ["queued", "extracting", "ready", "failed"]
+thesis_upload_pool = None
+
+# Text of thesis PDF for the search index
+THESIS_TEXT_SKIP_PAGES = 3
+THESIS_TEXT_CHARS = r"a-z а-я \n : / . () # - "
+_thesis_text_filter_re = re.compile("[^" + THESIS_TEXT_CHARS + "]")
+
+thesis_downloads = Counter(Thesis.download_thesis)
+presentation_downloads = Counter(Thesis.download_presentation)
+
+
+def build_theses_facets():
+    """Choices for the filters of theses search page with number of
+    published theses for each of them."""
+    facets = {}
+
+    # Names of worktypes and courses are taken from se_reference
+    facets["worktype"] = [
+        {"id": id, "name": worktypes.get(id).type, "count": count}
+        for id, count in db.session.query(Thesis.type_id, func.count(Thesis.id))
+        .filter(Thesis.temporary == False)
+        .group_by(Thesis.type_id)
+        if id in worktypes
+    ]
 
-def theses_search():
-    filter = ThesisFilter()
-    hints = [
-        '"Максим" можно искать как Максим, максим, Макс* или *акс*.',
-        "Полнотекстовый поиск по названиям работ и авторам",
-        '"Дом" можно искать как дом, д?м или д*м',
+    facets["course"] = [
+        {"id": id, "name": courses.get(id).name, "count": count}
+        for id, count in db.session.query(Thesis.course_id, func.count(Thesis.id))
+        .filter(Thesis.temporary == False)
+        .group_by(Thesis.course_id)
+        if id in courses
     ]
 
-    hint = random.choice(hints)
+    facets["supervisor"] = []
+    for id, last_name, first_name, middle_name, count in (
+        db.session.query(
+            Staff.id,
+            Users.last_name,
+            Users.first_name,
+            Users.middle_name,
+            func.count(Thesis.id),
+        )
+        .join(Users, Staff.user_id == Users.id)
+        .join(Thesis, Thesis.supervisor_id == Staff.id)
+        .filter(Thesis.temporary == False)
+        .group_by(Staff.id, Users.id)
+    ):
+        initials = ""
 
-    for sid in Thesis.query.with_entities(Thesis.type_id).distinct().all():
-        type = Worktype.query.filter_by(id=sid[0]).first()
+        if first_name:
+            initials = initials + first_name[0] + "."
 
-        filter.worktype.choices.append((sid[0], type.type))
-        filter.worktype.choices.sort(key=lambda tup: tup[1])
+        if middle_name:
+            initials = initials + middle_name[0] + "."
 
-    for sid in Thesis.query.with_entities(Thesis.course_id).distinct().all():
-        course = Courses.query.filter_by(id=sid[0]).first()
+        facets["supervisor"].append(
+            {"id": id, "name": (last_name or "") + " " + initials, "count": count}
+        )
 
-        filter.course.choices.append((sid[0], course.name))
-        filter.course.choices.sort(key=lambda tup: tup[1])
+    for name in ["worktype", "course", "supervisor"]:
+        facets[name].sort(key=lambda item: item["name"])
 
-    dates = [
-        theses.publish_year
-        for theses in Thesis.query.filter(Thesis.temporary == False)
-        .with_entities(Thesis.publish_year)
+    facets["dates"] = [
+        year
+        for year, in db.session.query(Thesis.publish_year)
+        .filter(Thesis.temporary == False)
         .distinct()
+        .order_by(Thesis.publish_year.desc())
     ]
-    dates.sort(reverse=True)
-    filter.startdate.choices = dates
-    filter.enddate.choices = dates
 
-    for sid in Thesis.query.with_entities(Thesis.supervisor_id).distinct().all():
-        staff = Staff.query.filter_by(id=sid[0]).first()
-        last_name = ""
-        initials = ""
+    return facets
 
-        if not staff:
-            staff = Staff.query.filter_by(id=1).first()
 
-        if staff.user.last_name:
-            last_name = staff.user.last_name
+theses_facets = TableCache(
+    build_theses_facets, ["thesis", "staff", "users", "worktype", "courses"]
+)
 
-        if staff.user.first_name:
-            initials = initials + staff.user.first_name[0] + "."
 
-        if staff.user.middle_name:
-            initials = initials + staff.user.middle_name[0] + "."
+def facet_label(item):
+    return item["name"] + " (" + str(item["count"]) + ")"
 
-        filter.supervisor.choices.append((sid[0], last_name + " " + initials))
-        filter.supervisor.choices.sort(key=lambda tup: tup[1])
 
-    filter.supervisor.choices.insert(0, (0, "Все"))
-    filter.course.choices.insert(0, (0, "Все"))
-    filter.worktype.choices.insert(0, (0, "Все"))
+@cached_page(["thesis", "staff", "users", "worktype", "courses"])
+def theses_search():
+    filter = ThesisFilter()
+    hints = [
+        '"Максим" можно искать как Максим, максим или Макс*.',
+        "Полнотекстовый поиск по названиям, авторам и текстам работ",
+        '"Дом" можно искать как дом, Дом или До*',
+    ]
+
+    hint = random.choice(hints)
+
+    facets = theses_facets.get()
+
+    filter.worktype.choices = [(0, "Все")] + [
+        (item["id"], facet_label(item)) for item in facets["worktype"]
+    ]
+    filter.course.choices = [(0, "Все")] + [
+        (item["id"], facet_label(item)) for item in facets["course"]
+    ]
+    filter.supervisor.choices = [(0, "Все")] + [
+        (item["id"], facet_label(item)) for item in facets["supervisor"]
+    ]
+    filter.startdate.choices = facets["dates"]
+    filter.enddate.choices = facets["dates"]
 
     return render_template("theses.html", filter=filter, hint=hint)
 
 
+@cached_page(
+    ["thesis", "thesis_text", "staff", "users", "worktype", "courses", "tag", "tags"]
+)
 def fetch_theses():
     worktype = request.args.get("worktype", default=1, type=int)
     page = request.args.get("page", default=1, type=int)
     supervisor = request.args.get("supervisor", default=0, type=int)
     course = request.args.get("course", default=0, type=int)
     search = request.args.get("search", default="", type=str)
+    cursor = request.args.get("cursor", default=None, type=str)
+    with_total = request.args.get("total", default=0, type=int)
     context = {}
 
-    dates = [
-        theses.publish_year
-        for theses in Thesis.query.filter(Thesis.temporary == False)
-        .with_entities(Thesis.publish_year)
-        .distinct()
-    ]
-    dates.sort(reverse=True)
+    facets = theses_facets.get()
+    dates = facets["dates"]
 
     if dates:
         startdate = request.args.get("startdate", default=dates[-1], type=int)
@@ -105,21 +172,17 @@ def fetch_theses():
     if enddate < startdate:
         enddate = startdate
 
-    if search:
-        records = (
-            Thesis.query.msearch(search)
-            .filter(Thesis.temporary == False)
-            .filter(Thesis.publish_year >= startdate)
-            .filter(Thesis.publish_year <= enddate)
-            .order_by(Thesis.publish_year.desc())
-        )
-    else:
-        records = (
-            Thesis.query.filter(Thesis.temporary == False)
-            .filter(Thesis.publish_year >= startdate)
-            .filter(Thesis.publish_year <= enddate)
-            .order_by(Thesis.publish_year.desc())
-        )
+    records = (
+        Thesis.query.filter(Thesis.temporary == False)
+        .filter(Thesis.publish_year >= startdate)
+        .filter(Thesis.publish_year <= enddate)
+    )
+
+    match_query = make_match_query(search)
+    if match_query:
+        records = search_theses(records, match_query)
+
+    records = records.order_by(Thesis.publish_year.desc())
 
     if course:
         # Check if course exists
@@ -127,45 +190,29 @@ def fetch_theses():
 
     if supervisor:
         # Check if supervisor exists
-        ids = Thesis.query.with_entities(Thesis.supervisor_id).distinct().all()
-        if [item for item in ids if item[0] == supervisor]:
+        if [item for item in facets["supervisor"] if item["id"] == supervisor]:
             records = records.filter(Thesis.supervisor_id == supervisor)
         else:
             supervisor = 0
 
     if worktype > 1:
-        records = records.filter_by(type_id=worktype).paginate(
-            per_page=10, page=page, error_out=False
+        records = records.filter_by(type_id=worktype)
+
+    # Search results are ordered by rank, so there is no key for a cursor
+    if cursor is not None and not match_query:
+        records = keyset_paginate(
+            records,
+            [(Thesis.publish_year, True), (Thesis.id, True)],
+            cursor,
+            per_page=10,
+            with_total=with_total,
         )
     else:
         records = records.paginate(per_page=10, page=page, error_out=False)
 
     if len(records.items):
-        first_priority = []
-        second_priority = []
-        third_priority = []
-
-        for item in records.items:
-            text_index = item.text.find(search.lower())
-            search_in_name = (
-                str(item.name_ru).lower().find(search.lower()) != -1
-                or str(item.description).lower().find(search.lower()) != -1
-                or str(item.author).lower().find(search.lower()) != -1
-            )
-
-            if search_in_name and text_index != -1:
-                first_priority.append(item)
-            elif search_in_name:
-                second_priority.append(item)
-            else:
-                third_priority.append(item)
-
-            if text_index != -1:
-                left_space_index = item.text.find(" ", text_index - 60)
-                right_space_index = item.text.find(" ", text_index + 60)
-                context[item] = item.text[left_space_index:right_space_index].split()
-
-        records.items = first_priority + second_priority + third_priority
+        if match_query:
+            context = search_snippets([item.id for item in records.items], search)
 
         return render_template(
             "fetch_theses.html",
@@ -182,17 +229,40 @@ def fetch_theses():
         return render_template("fetch_theses_blank.html")
 
 
-def get_text(filename):
-    doc = fitz.open(filename)
-    text = ""
+def iter_text(filename):
+    """Yield normalized text of thesis pages one by one.
+
+    First three pages (title, abstract, contents) are skipped. Every page is
+    normalized once: hyphenated line breaks are joined and characters outside
+    of THESIS_TEXT_CHARS are dropped. Hyphens are dropped too, so a word
+    broken at the end of a page is joined with the next page as before.
+    """
+    with fitz.open(filename) as doc:
+        for current_page in range(THESIS_TEXT_SKIP_PAGES, len(doc)):
+            page = doc.load_page(current_page)
+            text = page.get_text("text").lower() + "\n"
+            text = text.replace("-\n", "")
+            yield _thesis_text_filter_re.sub("", text)
+
 
-    for current_page in range(3, len(doc)):
-        page = doc.load_page(current_page)
-        text += page.get_text("text").lower() + "\n"
-        text = text.replace("-\n", "")
-        text = re.sub(r"[^a-z а-я \n : / . () # - ]", "", text)
+def get_text(filename, output=None, pages=False):
+    """Extract normalized text of thesis PDF.
 
-    return text
+    Returns text as a string, or a list of page texts if pages is True.
+    If output (file-like object) is given the text is written there page by
+    page and nothing is returned.
+    """
+    if output is not None:
+        for text in iter_text(filename):
+            output.write(text)
+        return None
+
+    if pages:
+        return list(iter_text(filename))
+
+    buffer = io.StringIO()
+    get_text(filename, output=buffer)
+    return buffer.getvalue()
 
 
 # Download thesis link
@@ -210,13 +280,33 @@ def download_thesis():
     if not thesis.text_uri:
         return redirect("theses_search")
 
-    # Increment counter
-    thesis.download_thesis = thesis.download_thesis + 1
-    db.session.commit()
+    thesis_downloads.increment(thesis.id)
 
     return redirect(url_for("static", filename="/thesis/texts/" + thesis.text_uri))
 
 
+# Download presentation link
+def download_presentation():
+    thesis_id = request.args.get("thesis_id", default=0, type=int)
+
+    if not thesis_id:
+        return redirect("theses_search")
+
+    thesis = Thesis.query.filter_by(id=thesis_id).first()
+
+    if not thesis:
+        return redirect("theses_search")
+
+    if not thesis.presentation_uri:
+        return redirect("theses_search")
+
+    presentation_downloads.increment(thesis.id)
+
+    return redirect(
+        url_for("static", filename="/thesis/slides/" + thesis.presentation_uri)
+    )
+
+
 def post_theses():
     error_status = 500
     success_status = 0
@@ -323,7 +413,10 @@ def post_theses():
 
     # Before we going on, check if this thesis already exists?
     records = Thesis.query.filter_by(text_uri=thesis_filename)
-    if records.count():
+    uploads = ThesisUpload.query.filter_by(text_uri=thesis_filename).filter(
+        ThesisUpload.status < 2
+    )
+    if records.count() or uploads.count():
         return jsonify(
             status=error_status, string="Work already exists: " + str(thesis_filename)
         )
@@ -331,8 +424,6 @@ def post_theses():
     # Save file to TMP
     thesis_text.save(os.path.join("./static/tmp/texts/", thesis_filename))
 
-    text = get_text(os.path.join("./static/tmp/texts/", thesis_filename))
-
     if presentation:
         presentation_filename = author_en
         presentation_filename = (
@@ -382,52 +473,177 @@ def post_theses():
             os.path.join("./static/tmp/reviews/", reviewer_review_filename)
         )
 
+    thesis_fields = {
+        "name_ru": name_ru,
+        "text_uri": thesis_filename,
+        "presentation_uri": presentation_filename,
+        "supervisor_review_uri": supervisor_review_filename,
+        "reviewer_review_uri": reviewer_review_filename,
+        "author": author,
+        "supervisor_id": supervisor_id,
+        "reviewer_id": 2,
+        "publish_year": publish_year,
+        "type_id": type_id,
+        "course_id": course_id,
+    }
+
     if source_uri:
-        t = Thesis(
-            name_ru=name_ru,
-            text_uri=thesis_filename,
-            presentation_uri=presentation_filename,
-            supervisor_review_uri=supervisor_review_filename,
-            reviewer_review_uri=reviewer_review_filename,
-            author=author,
-            supervisor_id=supervisor_id,
-            reviewer_id=2,
-            publish_year=publish_year,
-            type_id=type_id,
-            course_id=course_id,
-            source_uri=source_uri,
-            temporary=True,
-            text=text,
-        )
-    else:
-        t = Thesis(
-            name_ru=name_ru,
-            text_uri=thesis_filename,
-            presentation_uri=presentation_filename,
-            supervisor_review_uri=supervisor_review_filename,
-            reviewer_review_uri=reviewer_review_filename,
-            author=author,
-            supervisor_id=supervisor_id,
-            reviewer_id=2,
-            publish_year=publish_year,
-            type_id=type_id,
-            course_id=course_id,
-            temporary=True,
-            text=text,
-        )
+        thesis_fields["source_uri"] = source_uri
 
-    db.session.add(t)
+    # Text is extracted and thesis is created by process_thesis_uploads
+    upload = ThesisUpload(
+        text_uri=thesis_filename, thesis_info=json.dumps(thesis_fields)
+    )
+    db.session.add(upload)
 
     try:
         db.session.commit()
     except AssertionError as err:
         db.session.rollback()
         log.error(err)
+        return jsonify(status=error_status, string="Can't queue thesis upload")
     except Exception as err:
         db.session.rollback()
         log.error(err)
+        return jsonify(status=error_status, string="Can't queue thesis upload")
 
-    return jsonify(status=success_status, string="Success")
+    return jsonify(status=success_status, string="Success", job_id=upload.id)
+
+
+def post_theses_status():
+    error_status = 500
+    success_status = 0
+
+    # Not in the query string, it goes to access logs
+    secret_key = request.headers.get("X-Secret-Key") or request.form.get("secret_key")
+    job_id = request.values.get("job_id", default=0, type=int)
+
+    if secret_key != SECRET_KEY_THESIS:
+        return jsonify(
+            status=error_status, string="Invalid secret key: " + str(secret_key)
+        )
+
+    upload = ThesisUpload.query.filter_by(id=job_id).first()
+
+    if not upload:
+        return jsonify(status=error_status, string="No such job: " + str(job_id))
+
+    return jsonify(
+        status=success_status,
+        job_id=upload.id,
+        state=THESIS_UPLOAD_STATES[upload.status],
+        thesis_id=upload.thesis_id,
+        error=upload.error,
+    )
+
+
+def thesis_upload_claimable(now):
+    return (ThesisUpload.status == 0) | (
+        (ThesisUpload.status == 1)
+        & ((ThesisUpload.lease_until == None) | (ThesisUpload.lease_until < now))
+    )
+
+
+def process_thesis_uploads():
+    """Extract text of queued uploads in the worker pool and create theses.
+
+    Runs as a scheduler job. An upload is claimed by switching its status
+    from "queued" so it is processed once even if the job runs in several
+    processes. A claim of a crashed process expires after
+    THESIS_UPLOAD_LEASE_SECONDS and the upload is claimed again.
+    """
+    now = datetime.utcnow()
+    lease = {
+        "status": 1,
+        "lease_until": now + timedelta(seconds=THESIS_UPLOAD_LEASE_SECONDS),
+    }
+
+    uploads = (
+        ThesisUpload.query.filter(thesis_upload_claimable(now))
+        .order_by(ThesisUpload.id)
+        .limit(THESIS_UPLOAD_BATCH)
+        .all()
+    )
+
+    claimed = []
+    for upload in uploads:
+        if (
+            ThesisUpload.query.filter_by(id=upload.id)
+            .filter(thesis_upload_claimable(now))
+            .update(lease, synchronize_session=False)
+        ):
+            claimed.append(upload)
+    db.session.commit()
+
+    if not claimed:
+        return
+
+    try:
+        pool = get_thesis_upload_pool()
+        futures = [
+            pool.submit(get_text, os.path.join("./static/tmp/texts/", upload.text_uri))
+            for upload in claimed
+        ]
+    except Exception as err:
+        # Broken pool, return uploads to the queue and start a new pool next time
+        log.error(err)
+        reset_thesis_upload_pool()
+        for upload in claimed:
+            upload.status = 0
+            upload.lease_until = None
+        db.session.commit()
+        return
+
+    for upload, future in zip(claimed, futures):
+        try:
+            text = future.result()
+        except BrokenExecutor as err:
+            # A worker of the pool was killed, not a problem of the upload:
+            # return it to the queue and start a new pool next time
+            log.error(err)
+            reset_thesis_upload_pool()
+            upload.status = 0
+            upload.lease_until = None
+            db.session.commit()
+            continue
+        except Exception as err:
+            log.error(err)
+            upload.status = 3
+            upload.error = str(err)[:1024]
+            db.session.commit()
+            continue
+
+        t = Thesis(temporary=True, text=text, **json.loads(upload.thesis_info))
+        db.session.add(t)
+
+        try:
+            db.session.flush()
+            upload.thesis_id = t.id
+            upload.status = 2
+            db.session.commit()
+        except Exception as err:
+            db.session.rollback()
+            log.error(err)
+            upload.status = 3
+            upload.error = str(err)[:1024]
+            db.session.commit()
+
+
+def get_thesis_upload_pool():
+    global thesis_upload_pool
+
+    if thesis_upload_pool is None:
+        thesis_upload_pool = ProcessPoolExecutor(max_workers=THESIS_UPLOAD_WORKERS)
+
+    return thesis_upload_pool
+
+
+def reset_thesis_upload_pool():
+    global thesis_upload_pool
+
+    if thesis_upload_pool is not None:
+        thesis_upload_pool.shutdown(wait=False)
+        thesis_upload_pool = None
 
 
 def theses_tmp():
@@ -0,0 +1,263 @@
+"""Move thesis text to thesis_text table
+
+Revision ID: 3b1f0e6a9d27
+Revises: c4e88555c985
+Create Date: 2026-10-18 12:10:41.218304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3b1f0e6a9d27"
+down_revision = "c4e88555c985"
+branch_labels = None
+depends_on = None
+
+
+# SQLite FTS5 index
+fts_drop = [
+    "DROP TRIGGER IF EXISTS thesis_text_fts_au",
+    "DROP TRIGGER IF EXISTS thesis_text_fts_ad",
+    "DROP TRIGGER IF EXISTS thesis_text_fts_ai",
+    "DROP TRIGGER IF EXISTS thesis_fts_au",
+    "DROP TRIGGER IF EXISTS thesis_fts_ad",
+    "DROP TRIGGER IF EXISTS thesis_fts_ai",
+    "DROP TABLE IF EXISTS thesis_fts",
+    "DROP VIEW IF EXISTS thesis_fts_content",
+]
+
+fts_create = [
+    """
+    CREATE VIEW thesis_fts_content AS
+    SELECT thesis.id AS id, thesis.name_ru AS name_ru,
+           thesis.description AS description, thesis.author AS author,
+           thesis_text.text AS text
+    FROM thesis LEFT JOIN thesis_text ON thesis_text.thesis_id = thesis.id
+    """,
+    """
+    CREATE VIRTUAL TABLE thesis_fts USING fts5(
+        name_ru, description, author, text,
+        content='thesis_fts_content', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ai AFTER INSERT ON thesis BEGIN
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = new.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ad AFTER DELETE ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = old.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_au AFTER UPDATE OF name_ru, description, author
+    ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = old.id));
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = new.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_ai AFTER INSERT ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, NULL
+        FROM thesis WHERE id = new.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, new.text
+        FROM thesis WHERE id = new.thesis_id;
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_ad AFTER DELETE ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, old.text
+        FROM thesis WHERE id = old.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, NULL
+        FROM thesis WHERE id = old.thesis_id;
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_au AFTER UPDATE OF text ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, old.text
+        FROM thesis WHERE id = old.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, new.text
+        FROM thesis WHERE id = new.thesis_id;
+    END
+    """,
+    "INSERT INTO thesis_fts(thesis_fts) VALUES ('rebuild')",
+]
+
+# Index of the previous version, on "thesis" with the text in thesis.text
+fts_create_previous = [
+    """
+    CREATE VIRTUAL TABLE thesis_fts USING fts5(
+        name_ru, description, author, text,
+        content='thesis', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ai AFTER INSERT ON thesis BEGIN
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ad AFTER DELETE ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_au AFTER UPDATE OF name_ru, description, author, text
+    ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author, old.text);
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author, new.text);
+    END
+    """,
+    "INSERT INTO thesis_fts(thesis_fts) VALUES ('rebuild')",
+]
+
+# PostgreSQL index: table of tsvector documents with a GIN index
+postgresql_fts_create = [
+    """
+    CREATE VIEW thesis_fts_content AS
+    SELECT thesis.id AS id,
+           setweight(to_tsvector('simple', coalesce(thesis.name_ru, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(thesis.author, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(thesis.description, '')), 'B') ||
+           setweight(to_tsvector('simple', coalesce(thesis_text.text, '')), 'D')
+           AS document
+    FROM thesis LEFT JOIN thesis_text ON thesis_text.thesis_id = thesis.id
+    """,
+    """
+    CREATE TABLE thesis_fts (
+        thesis_id integer PRIMARY KEY REFERENCES thesis (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_thesis_fts_document ON thesis_fts USING gin (document)",
+    """
+    CREATE FUNCTION thesis_fts_refresh(refresh_id integer) RETURNS void AS $$
+        DELETE FROM thesis_fts WHERE thesis_id = refresh_id;
+        INSERT INTO thesis_fts (thesis_id, document)
+        SELECT id, document FROM thesis_fts_content WHERE id = refresh_id;
+    $$ LANGUAGE SQL
+    """,
+    """
+    CREATE FUNCTION thesis_fts_thesis_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM thesis_fts_refresh(NEW.id);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER thesis_fts_aiu
+    AFTER INSERT OR UPDATE OF name_ru, description, author ON thesis
+    FOR EACH ROW EXECUTE PROCEDURE thesis_fts_thesis_changed()
+    """,
+    """
+    CREATE FUNCTION thesis_fts_text_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM thesis_fts_refresh(OLD.thesis_id);
+        ELSE
+            PERFORM thesis_fts_refresh(NEW.thesis_id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_aiud
+    AFTER INSERT OR UPDATE OF text OR DELETE ON thesis_text
+    FOR EACH ROW EXECUTE PROCEDURE thesis_fts_text_changed()
+    """,
+    "INSERT INTO thesis_fts (thesis_id, document) "
+    "SELECT id, document FROM thesis_fts_content",
+]
+
+postgresql_fts_drop = [
+    "DROP TRIGGER IF EXISTS thesis_text_fts_aiud ON thesis_text",
+    "DROP TRIGGER IF EXISTS thesis_fts_aiu ON thesis",
+    "DROP FUNCTION IF EXISTS thesis_fts_text_changed()",
+    "DROP FUNCTION IF EXISTS thesis_fts_thesis_changed()",
+    "DROP FUNCTION IF EXISTS thesis_fts_refresh(integer)",
+    "DROP TABLE IF EXISTS thesis_fts",
+    "DROP VIEW IF EXISTS thesis_fts_content",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        for statement in fts_drop:
+            op.execute(statement)
+
+    op.create_table(
+        "thesis_text",
+        sa.Column("thesis_id", sa.Integer(), nullable=False),
+        sa.Column("text", sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["thesis_id"],
+            ["thesis.id"],
+            name=op.f("fk_thesis_text_thesis_id_thesis"),
+        ),
+        sa.PrimaryKeyConstraint("thesis_id", name=op.f("pk_thesis_text")),
+    )
+    op.execute(
+        "INSERT INTO thesis_text (thesis_id, text) "
+        "SELECT id, text FROM thesis WHERE text IS NOT NULL"
+    )
+
+    with op.batch_alter_table("thesis", schema=None) as batch_op:
+        batch_op.drop_column("text")
+
+    if dialect == "sqlite":
+        for statement in fts_create:
+            op.execute(statement)
+    elif dialect == "postgresql":
+        for statement in postgresql_fts_create:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        for statement in fts_drop:
+            op.execute(statement)
+    elif dialect == "postgresql":
+        for statement in postgresql_fts_drop:
+            op.execute(statement)
+
+    with op.batch_alter_table("thesis", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("text", sa.Text(), nullable=True))
+
+    op.execute(
+        "UPDATE thesis SET text = "
+        "(SELECT text FROM thesis_text WHERE thesis_text.thesis_id = thesis.id)"
+    )
+    op.drop_table("thesis_text")
+
+    if dialect == "sqlite":
+        for statement in fts_create_previous:
+            op.execute(statement)
@@ -0,0 +1,134 @@
+"""Add file fingerprint to thesis_text
+
+Revision ID: 5e2b9f4c7a18
+Revises: 8d4c2a7e51f3
+Create Date: 2026-10-18 14:21:36.117420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5e2b9f4c7a18"
+down_revision = "8d4c2a7e51f3"
+branch_labels = None
+depends_on = None
+
+
+# SQLite search index objects refer to "thesis_text" and block its
+# recreation by batch_alter_table
+fts_drop = [
+    "DROP TRIGGER IF EXISTS thesis_text_fts_au",
+    "DROP TRIGGER IF EXISTS thesis_text_fts_ad",
+    "DROP TRIGGER IF EXISTS thesis_text_fts_ai",
+    "DROP TRIGGER IF EXISTS thesis_fts_au",
+    "DROP TRIGGER IF EXISTS thesis_fts_ad",
+    "DROP TRIGGER IF EXISTS thesis_fts_ai",
+    "DROP TABLE IF EXISTS thesis_fts",
+    "DROP VIEW IF EXISTS thesis_fts_content",
+]
+
+# Search index of the previous revision, the same as of 3b1f0e6a9d27
+fts_create = [
+    """
+    CREATE VIEW thesis_fts_content AS
+    SELECT thesis.id AS id, thesis.name_ru AS name_ru,
+           thesis.description AS description, thesis.author AS author,
+           thesis_text.text AS text
+    FROM thesis LEFT JOIN thesis_text ON thesis_text.thesis_id = thesis.id
+    """,
+    """
+    CREATE VIRTUAL TABLE thesis_fts USING fts5(
+        name_ru, description, author, text,
+        content='thesis_fts_content', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ai AFTER INSERT ON thesis BEGIN
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = new.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ad AFTER DELETE ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = old.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_au AFTER UPDATE OF name_ru, description, author
+    ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = old.id));
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = new.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_ai AFTER INSERT ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, NULL
+        FROM thesis WHERE id = new.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, new.text
+        FROM thesis WHERE id = new.thesis_id;
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_ad AFTER DELETE ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, old.text
+        FROM thesis WHERE id = old.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, NULL
+        FROM thesis WHERE id = old.thesis_id;
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_au AFTER UPDATE OF text ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, old.text
+        FROM thesis WHERE id = old.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, new.text
+        FROM thesis WHERE id = new.thesis_id;
+    END
+    """,
+    "INSERT INTO thesis_fts(thesis_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table("thesis_text", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("file_size", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("file_mtime", sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column("file_sha1", sa.String(length=40), nullable=True))
+
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    sqlite = op.get_bind().dialect.name == "sqlite"
+
+    if sqlite:
+        for statement in fts_drop:
+            op.execute(statement)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table("thesis_text", schema=None) as batch_op:
+        batch_op.drop_column("file_sha1")
+        batch_op.drop_column("file_mtime")
+        batch_op.drop_column("file_size")
+
+    # ### end Alembic commands ###
+
+    if sqlite:
+        for statement in fts_create:
+            op.execute(statement)
@@ -0,0 +1,118 @@
+"""Add indexes for hot queries
+
+Revision ID: da9f087f8f7b
+Revises: e1f6b3a8c290
+Create Date: 2026-10-18 05:18:57.589714
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "da9f087f8f7b"
+down_revision = "e1f6b3a8c290"
+branch_labels = None
+depends_on = None
+
+
+# Indexes are created without batch mode: thesis is not recreated, so the
+# thesis_fts triggers and view stay as they are
+
+
+def upgrade():
+    op.create_index(
+        "ix_current_thesis_area_worktype",
+        "current_thesis",
+        ["area_id", "worktype_id", "status", "deleted"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_current_thesis_author_id"),
+        "current_thesis",
+        ["author_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_current_thesis_supervisor_status",
+        "current_thesis",
+        ["supervisor_id", "status", "deleted"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_diploma_themes_author_id"),
+        "diploma_themes",
+        ["author_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_diploma_themes_status"), "diploma_themes", ["status"], unique=False
+    )
+    op.create_index(
+        op.f("ix_diploma_themes_supervisor_id"),
+        "diploma_themes",
+        ["supervisor_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_notification_lease_owner"),
+        "notification",
+        ["lease_owner"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_notification_recipient"), "notification", ["recipient"], unique=False
+    )
+    op.create_index(
+        "ix_notification_practice_recipient",
+        "notification_practice",
+        ["recipient_id", "viewed", "time"],
+        unique=False,
+    )
+    op.create_index(op.f("ix_posts_created_on"), "posts", ["created_on"], unique=False)
+    op.create_index(op.f("ix_posts_rank"), "posts", ["rank"], unique=False)
+    op.create_index(op.f("ix_thesis_course_id"), "thesis", ["course_id"], unique=False)
+    op.create_index(
+        op.f("ix_thesis_supervisor_id"), "thesis", ["supervisor_id"], unique=False
+    )
+    op.create_index(
+        "ix_thesis_temporary_publish_year",
+        "thesis",
+        ["temporary", "publish_year"],
+        unique=False,
+    )
+    op.create_index(op.f("ix_thesis_type_id"), "thesis", ["type_id"], unique=False)
+    op.create_index(
+        "ix_thesis_on_review_status",
+        "thesis_on_review",
+        ["review_status", "deleted"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_thesis_report_current_thesis",
+        "thesis_report",
+        ["current_thesis_id", "deleted", "time"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_thesis_report_current_thesis", table_name="thesis_report")
+    op.drop_index("ix_thesis_on_review_status", table_name="thesis_on_review")
+    op.drop_index(op.f("ix_thesis_type_id"), table_name="thesis")
+    op.drop_index("ix_thesis_temporary_publish_year", table_name="thesis")
+    op.drop_index(op.f("ix_thesis_supervisor_id"), table_name="thesis")
+    op.drop_index(op.f("ix_thesis_course_id"), table_name="thesis")
+    op.drop_index(op.f("ix_posts_rank"), table_name="posts")
+    op.drop_index(op.f("ix_posts_created_on"), table_name="posts")
+    op.drop_index(
+        "ix_notification_practice_recipient", table_name="notification_practice"
+    )
+    op.drop_index(op.f("ix_notification_recipient"), table_name="notification")
+    op.drop_index(op.f("ix_notification_lease_owner"), table_name="notification")
+    op.drop_index(op.f("ix_diploma_themes_supervisor_id"), table_name="diploma_themes")
+    op.drop_index(op.f("ix_diploma_themes_status"), table_name="diploma_themes")
+    op.drop_index(op.f("ix_diploma_themes_author_id"), table_name="diploma_themes")
+    op.drop_index("ix_current_thesis_supervisor_status", table_name="current_thesis")
+    op.drop_index(op.f("ix_current_thesis_author_id"), table_name="current_thesis")
+    op.drop_index("ix_current_thesis_area_worktype", table_name="current_thesis")
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import time
+from threading import Lock
+
+from se_models import data_version
+
+# In-process caches of values built from database tables. A cache is built
+# again when the change stamp of its tables (se_models.data_version) moves,
+# after a commit to one of the tables in any process. ttl is a safety net
+# for changes made by plain SQL, which are not stamped.
+
+
+class TableCache:
+    def __init__(self, builder, tables, ttl=300):
+        self.builder = builder
+        self.tables = set(tables)
+        self.ttl = ttl
+
+        self._value = None
+        self._version = None
+        self._built_at = None
+        self._lock = Lock()
+
+    def get(self):
+        # The stamp is read before the build: a change committed during the
+        # build only makes the next get() build once more
+        version = data_version(*self.tables)
+
+        with self._lock:
+            if (
+                self._built_at is None
+                or self._version != version
+                or time.monotonic() - self._built_at > self.ttl
+            ):
+                self._value = self.builder()
+                self._version = version
+                self._built_at = time.monotonic()
+
+            return self._value
+
+    def lookup(self, key, loader):
+        """Item of a cache of a dict: value[key], or loader(key) kept in the
+        dict if it is missing. loader runs outside the lock, None is not
+        kept."""
+        value = self.get()
+
+        with self._lock:
+            item = value.get(key)
+
+        if item is None:
+            item = loader(key)
+
+            if item is not None:
+                with self._lock:
+                    item = value.setdefault(key, item)
+
+        return item
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._version = None
+            self._built_at = None
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import logging
+import time
+from collections import defaultdict
+from threading import Lock, Thread
+
+from sqlalchemy import bindparam, func
+
+from se_models import db
+
+log = logging.getLogger("flask_se.sub")
+
+# Download and view counters. A click only adds the increment to a buffer in
+# the memory of the process, flush_counters() writes summed increments of all
+# counters in one transaction. The UPDATEs don't move change stamps of the
+# tables (se_models.data_version). Every process flushes its own buffer: a thread
+# started with the first increment calls flush_counters() once in
+# FLUSH_INTERVAL seconds (not the scheduler, it runs in the jobs leader
+# only). Increments of the last few seconds are lost if the process is killed.
+FLUSH_INTERVAL = 10
+
+_counters = {}
+_pending = defaultdict(int)
+_lock = Lock()
+
+_flusher = None
+_flusher_lock = Lock()
+
+
+class Counter:
+    def __init__(self, column, after_flush=None):
+        """column is an integer model attribute (Thesis.download_thesis),
+        after_flush(ids) is called in the flush transaction with ids of
+        records whose counter was changed, its changes should not be stamped
+        either."""
+        self.column = column
+        self.table = column.class_.__table__
+        self.name = column.key
+        self.after_flush = after_flush
+
+        _counters[(self.table.name, self.name)] = self
+
+    def increment(self, record_id, delta=1):
+        with _lock:
+            _pending[(self.table.name, self.name, record_id)] += delta
+
+        start_flusher()
+
+    def update_statement(self):
+        id_column = self.table.c.id
+        column = self.table.c[self.name]
+
+        return (
+            self.table.update()
+            .where(id_column == bindparam("record_id"))
+            .values({column: func.coalesce(column, 0) + bindparam("delta")})
+            .execution_options(stamp_tables=False)
+        )
+
+
+def take_pending():
+    global _pending
+
+    with _lock:
+        pending = _pending
+        _pending = defaultdict(int)
+
+    return pending
+
+
+def restore_pending(pending):
+    with _lock:
+        for key, delta in pending.items():
+            _pending[key] += delta
+
+
+def flush_counters():
+    pending = take_pending()
+
+    if not pending:
+        return
+
+    updates = defaultdict(list)
+    for (table, name, record_id), delta in pending.items():
+        updates[(table, name)].append({"record_id": record_id, "delta": delta})
+
+    try:
+        for key, params in updates.items():
+            counter = _counters[key]
+            db.session.execute(counter.update_statement(), params)
+
+            if counter.after_flush:
+                counter.after_flush([p["record_id"] for p in params])
+
+        db.session.commit()
+    except Exception as err:
+        db.session.rollback()
+        log.error(err)
+        restore_pending(pending)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush_counters()
+        db.session.remove()
+
+
+def start_flusher():
+    """Start the flush thread of this process if it is not running."""
+    global _flusher
+
+    # A worker forked by uwsgi doesn't have the thread of the master
+    if _flusher is not None and _flusher.is_alive():
+        return
+
+    with _flusher_lock:
+        if _flusher is not None and _flusher.is_alive():
+            return
+
+        _flusher = Thread(target=_flush_periodically, name="FlushCounters", daemon=True)
+        _flusher.start()
+
+
+atexit.register(flush_counters)
@@ -22,6 +22,11 @@ from se_models import Worktype, AreasOfStudy
 
 # Thesis forms
 class ThesisFilter(FlaskForm):
+    # Filters are sent by GET and not validated. Without a CSRF token the
+    # page doesn't touch the session and is cached (se_page_cache)
+    class Meta:
+        csrf = False
+
     worktype = SelectField("worktype", choices=[])
     course = SelectField("course", choices=[])
     supervisor = SelectField("supervisor", choices=[])
@@ -72,6 +77,10 @@ class UserEditTheme(FlaskForm):
 
 
 class DiplomaThemesFilter(FlaskForm):
+    # Filters are sent by GET and not validated. See ThesisFilter
+    class Meta:
+        csrf = False
+
     company = SelectField("company", choices=[])
     level = SelectField("level", choices=[])
     supervisor = SelectField("supervisor", choices=[])
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import time
+from datetime import datetime
+from threading import Lock
+
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+
+from flask_se_config import JOBS_LOCK_FILE, JOBS_LEADER_RETRY
+from se_models import db, JobStat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger("flask_se.sub")
+
+# Background jobs run in one process only, the jobs leader. The leader is the
+# process holding an exclusive lock on JOBS_LOCK_FILE: the dedicated runner
+# ("python flask_se.py jobs") or, without it, one of the web workers. The lock
+# is released by OS when the process exits, so another process takes over.
+_leader_lock = Lock()
+_leader_file = None
+_leader_checked_at = None
+
+# Start time of running jobs, by job id
+_started = {}
+
+
+def acquire_jobs_lock(blocking=False):
+    """Try to become the jobs leader, returns True on success."""
+    global _leader_file
+
+    if _leader_file is not None:
+        return True
+
+    # No file locks (Windows), every process is a leader
+    if fcntl is None:
+        _leader_file = True
+        return True
+
+    f = open(JOBS_LOCK_FILE, "a")
+
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+
+    f.truncate(0)
+    f.write(str(os.getpid()))
+    f.flush()
+
+    _leader_file = f
+    return True
+
+
+def start_jobs_if_leader(scheduler):
+    """Start scheduler if this process becomes the jobs leader.
+
+    Called before every request of a web worker, a worker that is not the
+    leader tries to take the lock once in JOBS_LEADER_RETRY seconds.
+    """
+    global _leader_checked_at
+
+    if scheduler.running:
+        return
+
+    now = time.monotonic()
+    if _leader_checked_at is not None and now - _leader_checked_at < JOBS_LEADER_RETRY:
+        return
+
+    with _leader_lock:
+        if scheduler.running:
+            return
+
+        _leader_checked_at = now
+
+        if acquire_jobs_lock():
+            log.info("Process %d is the jobs leader", os.getpid())
+            scheduler.start()
+
+
+def run_jobs(scheduler):
+    """Entry point of the dedicated job runner, waits for the lock and runs
+    jobs until interrupted."""
+    print("Waiting for the jobs lock " + JOBS_LOCK_FILE)
+    acquire_jobs_lock(blocking=True)
+
+    print("Running jobs: " + ", ".join(job.id for job in scheduler.get_jobs()))
+    scheduler.start()
+
+    try:
+        while True:
+            time.sleep(60)
+    except (KeyboardInterrupt, SystemExit):
+        scheduler.shutdown()
+
+
+def record_job_stats(scheduler):
+    """Record number of runs, duration and errors of every job in job_stat."""
+    scheduler.add_listener(_job_submitted, EVENT_JOB_SUBMITTED)
+    scheduler.add_listener(_job_finished, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+
+def _job_submitted(event):
+    _started[event.job_id] = time.monotonic()
+
+
+def _job_finished(event):
+    # Runs in the thread of the job, after the job
+    started = _started.pop(event.job_id, None)
+    duration = time.monotonic() - started if started is not None else None
+
+    try:
+        if event.exception:
+            db.session.rollback()
+
+        stat = JobStat.query.get(event.job_id)
+        if not stat:
+            stat = JobStat(id=event.job_id, runs=0, failures=0, total_duration=0)
+            db.session.add(stat)
+
+        stat.runs = stat.runs + 1
+        stat.last_run_on = datetime.utcnow()
+
+        if duration is not None:
+            stat.last_duration = duration
+            stat.total_duration = stat.total_duration + duration
+
+        if event.exception:
+            stat.failures = stat.failures + 1
+            stat.last_error = repr(event.exception)[:1024]
+            stat.last_error_on = stat.last_run_on
+
+        db.session.commit()
+    except Exception as err:
+        db.session.rollback()
+        log.error(err)
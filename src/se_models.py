@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
 
+from itertools import chain
 from os import urandom, path
-import shutil
 
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import pytz
 from dateutil import tz
-from sqlalchemy import MetaData
-from flask import render_template
+import sqlite3
+from sqlalchemy import MetaData, event, inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.associationproxy import association_proxy
+from flask import g, has_request_context, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from flask_msearch import Search
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 
@@ -23,8 +28,13 @@ from flask_se_config import (
     SQLITE_DATABASE_NAME,
     SQLITE_DATABASE_BACKUP_NAME,
     SQLITE_DATABASE_PATH,
+    SQLITE_PRAGMAS,
+    MAIL_DIGEST_WINDOW,
 )
 
+# Rank of news older than that is not recalculated anymore
+POST_RANK_WINDOW_HOURS = 30 * 24
+
 convention = {
     "ix": "ix_%(column_0_label)s",
     "uq": "uq_%(table_name)s_%(column_0_name)s",
@@ -35,7 +45,22 @@ convention = {
 
 metadata = MetaData(naming_convention=convention)
 db = SQLAlchemy(metadata=metadata)
-search = Search()
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute("PRAGMA {0} = {1}".format(name, value))
+
+        cursor.close()
+
+
+def is_postgresql():
+    """True if the application database is PostgreSQL (DATABASE_URL)."""
+    return db.engine.dialect.name == "postgresql"
 
 
 tag = db.Table(
@@ -131,8 +156,6 @@ class Staff(db.Model):
 
 
 class Users(db.Model, UserMixin):
-    __searchable__ = ["first_name", "middle_name", "last_name"]
-
     id = db.Column(db.Integer, primary_key=True)
 
     email = db.Column(db.String(255), unique=True, nullable=True)
@@ -204,8 +227,15 @@ class Users(db.Model, UserMixin):
 
         return full_name
 
+    # staff and reviewer are loaded with the current user (load_user)
     def is_staff(self):
-        return Staff.query.filter_by(user_id=self.id).first() is not None
+        return bool(self.staff)
+
+    def get_staff(self):
+        return self.staff[0] if self.staff else None
+
+    def get_reviewer(self):
+        return self.reviewer[0] if self.reviewer else None
 
     def __str__(self):
         full_name = ""
@@ -259,9 +289,21 @@ class InternshipTag(db.Model):
 
 class CurrentThesis(db.Model):
     __tablename__ = "current_thesis"
+    __table_args__ = (
+        db.Index(
+            "ix_current_thesis_supervisor_status", "supervisor_id", "status", "deleted"
+        ),
+        db.Index(
+            "ix_current_thesis_area_worktype",
+            "area_id",
+            "worktype_id",
+            "status",
+            "deleted",
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
     area_id = db.Column(db.Integer, db.ForeignKey("areas_of_study.id"), nullable=True)
 
     title = db.Column(db.String(512), nullable=True)
@@ -296,6 +338,12 @@ class CurrentThesis(db.Model):
 
 
 class NotificationPractice(db.Model):
+    __table_args__ = (
+        db.Index(
+            "ix_notification_practice_recipient", "recipient_id", "viewed", "time"
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     recipient_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     content = db.Column(db.String(512), nullable=False)
@@ -338,6 +386,12 @@ class ThesisTask(db.Model):
 
 
 class ThesisReport(db.Model):
+    __table_args__ = (
+        db.Index(
+            "ix_thesis_report_current_thesis", "current_thesis_id", "deleted", "time"
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     current_thesis_id = db.Column(db.Integer, db.ForeignKey("current_thesis.id"))
@@ -456,12 +510,20 @@ class Courses(db.Model):
 
 
 class Thesis(db.Model):
-    __searchable__ = ["name_ru", "description", "author", "text"]
+    # Published theses are listed by temporary and publish_year, theses on
+    # moderation by temporary
+    __table_args__ = (
+        db.Index("ix_thesis_temporary_publish_year", "temporary", "publish_year"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
-    type_id = db.Column(db.Integer, db.ForeignKey("worktype.id"), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey("courses.id"), nullable=False)
+    type_id = db.Column(
+        db.Integer, db.ForeignKey("worktype.id"), nullable=False, index=True
+    )
+    course_id = db.Column(
+        db.Integer, db.ForeignKey("courses.id"), nullable=False, index=True
+    )
 
     area_id = db.Column(db.Integer, db.ForeignKey("areas_of_study.id"), nullable=True)
 
@@ -478,13 +540,26 @@ class Thesis(db.Model):
 
     author = db.Column(db.String(512), nullable=False)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
-    supervisor_id = db.Column(db.Integer, db.ForeignKey("staff.id"), nullable=True)
+    supervisor_id = db.Column(
+        db.Integer, db.ForeignKey("staff.id"), nullable=True, index=True
+    )
     reviewer_id = db.Column(db.Integer, db.ForeignKey("staff.id"), nullable=True)
 
     publish_year = db.Column(db.Integer, nullable=False)
     recomended = db.Column(db.Boolean, default=False, nullable=False)
     temporary = db.Column(db.Boolean, default=False, nullable=False)
-    text = db.Column(db.Text, nullable=True)
+
+    # Text extracted from the thesis file lives in its own table and is
+    # loaded only when accessed (indexing, snippets)
+    text_record = db.relationship(
+        "ThesisText",
+        uselist=False,
+        cascade="all, delete-orphan",
+        backref=db.backref("thesis", uselist=False),
+    )
+    text = association_proxy(
+        "text_record", "text", creator=lambda text: ThesisText(text=text)
+    )
 
     # 0 - success review (or not needed)
     # 1 - need to review
@@ -498,6 +573,42 @@ class Thesis(db.Model):
     download_presentation = db.Column(db.Integer, default=0, nullable=True)
 
 
+class ThesisText(db.Model):
+    thesis_id = db.Column(db.Integer, db.ForeignKey("thesis.id"), primary_key=True)
+    text = db.Column(db.Text, nullable=True)
+
+    # Fingerprint of the file the text was extracted from (extract_text.py)
+    file_size = db.Column(db.Integer, nullable=True)
+    file_mtime = db.Column(db.Float, nullable=True)
+    file_sha1 = db.Column(db.String(40), nullable=True)
+
+
+class ThesisUpload(db.Model):
+    # Queue, leases are written all the time, see _stamped()
+    __table_args__ = {"info": {"stamp_tables": False}}
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # 0 - queued
+    # 1 - text extraction (in progress) until lease_until
+    # 2 - ready, thesis is created
+    # 3 - failed
+    status = db.Column(db.Integer, default=0, nullable=False)
+    lease_until = db.Column(db.DateTime, nullable=True)
+
+    text_uri = db.Column(db.String(512), nullable=False)
+    # JSON with fields of the Thesis to create
+    thesis_info = db.Column(db.Text, nullable=False)
+
+    thesis_id = db.Column(db.Integer, db.ForeignKey("thesis.id"), nullable=True)
+    error = db.Column(db.String(1024), nullable=True)
+
+    created_on = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_on = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
 class AreasOfStudy(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     area = db.Column(db.String(512), nullable=False)
@@ -555,14 +666,16 @@ class Posts(db.Model):
     votes = db.Column(db.Integer, nullable=False, default=1)
     views = db.Column(db.Integer, nullable=False, default=1)
 
-    created_on = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+    created_on = db.Column(
+        db.DateTime(timezone=True), server_default=db.func.now(), index=True
+    )
     updated_on = db.Column(
         db.DateTime(timezone=True),
         server_default=db.func.now(),
         server_onupdate=db.func.now(),
     )
 
-    rank = db.Column(db.Float, nullable=False, default=post_ranking_score)
+    rank = db.Column(db.Float, nullable=False, default=post_ranking_score, index=True)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     all_news_votes = db.relationship("PostVote", back_populates="post")
 
@@ -621,7 +734,7 @@ class DiplomaThemes(db.Model):
     description = db.Column(db.String(2048), nullable=True)
     requirements = db.Column(db.String(2048), nullable=True)
     status = db.Column(
-        db.Integer, default=0, nullable=False
+        db.Integer, default=0, nullable=False, index=True
     )  # 0 - new, 1 - need update, 2 - approved, 3 - archive
 
     comment = db.Column(db.String(2048), nullable=True)
@@ -637,8 +750,12 @@ class DiplomaThemes(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey("company.id"))
     company = db.relationship("Company", back_populates="theme")
 
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    supervisor_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    author_id = db.Column(
+        db.Integer, db.ForeignKey("users.id"), nullable=False, index=True
+    )
+    supervisor_id = db.Column(
+        db.Integer, db.ForeignKey("users.id"), nullable=True, index=True
+    )
     supervisor_thesis_id = db.Column(
         db.Integer, db.ForeignKey("users.id"), nullable=True
     )
@@ -720,6 +837,10 @@ class Reviewer(db.Model):
 
 
 class ThesisOnReview(db.Model):
+    __table_args__ = (
+        db.Index("ix_thesis_on_review_status", "review_status", "deleted"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     type_id = db.Column(db.Integer, db.ForeignKey("worktype.id"), nullable=False)
@@ -759,23 +880,259 @@ class PromoCode(db.Model):
 
 
 class Notification(db.Model):
+    # Queue, leases are written all the time, see _stamped()
+    __table_args__ = {"info": {"stamp_tables": False}}
+
     id = db.Column(db.Integer, primary_key=True)
 
     # 0 - Mail
     type = db.Column(db.Integer, default=0, nullable=False)
 
-    recipient = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    recipient = db.Column(
+        db.Integer, db.ForeignKey("users.id"), nullable=False, index=True
+    )
     title = db.Column(db.String(512), nullable=True)
     content = db.Column(db.String(8192), nullable=True)
 
+    # Delivery queue, a sent notification is deleted
+    # 0 - waiting (for next_attempt_at)
+    # 1 - claimed by a worker until lease_until
+    # 2 - dead, all attempts failed
+    status = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    attempts = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
+    lease_owner = db.Column(db.String(32), nullable=True, index=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(1024), nullable=True)
+
+
+class JobStat(db.Model):
+    # Written after every run of a job, see _stamped()
+    __table_args__ = {"info": {"stamp_tables": False}}
+
+    # Scheduler job id
+    id = db.Column(db.String(128), primary_key=True)
+
+    runs = db.Column(db.Integer, default=0, nullable=False)
+    failures = db.Column(db.Integer, default=0, nullable=False)
+
+    # Seconds
+    last_duration = db.Column(db.Float, nullable=True)
+    total_duration = db.Column(db.Float, default=0, nullable=False)
+
+    last_run_on = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(1024), nullable=True)
+    last_error_on = db.Column(db.DateTime, nullable=True)
+
+
+class TableVersion(db.Model):
+    # Change stamp of a table, see data_version()
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+
+def _stamped(table):
+    """Changes of queues and statistics (tables with info stamp_tables=False)
+    are not stamped: no cache is built from them, and they are written by
+    every run of a job."""
+    return table.info.get("stamp_tables", True)
+
+
+def _flushed_tables(session):
+    """Tables written by a flush: tables of new, deleted and really changed
+    objects and association tables of their changed many-to-many
+    collections. An object is dirty after any assignment to its attribute,
+    even of the same value."""
+    tables = set()
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        state = inspect(obj)
+
+        if (
+            obj in session.new
+            or obj in session.deleted
+            or session.is_modified(obj, include_collections=False)
+        ):
+            tables.update(state.mapper.tables)
+
+        for relationship in state.mapper.relationships:
+            if relationship.secondary is None:
+                continue
+
+            if (
+                obj in session.deleted
+                or state.attrs[relationship.key].history.has_changes()
+            ):
+                tables.add(relationship.secondary)
 
-def recalculate_post_rank():
-    posts = Posts.query.order_by(Posts.id.desc()).limit(100).all()
+    return {table.name for table in tables if _stamped(table)}
 
-    for post in posts:
-        age = get_hours_since(post.created_on)
-        post.rank = post_ranking_score(post.votes, age, post.views)
 
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    session.info.setdefault("changed_tables", set()).update(_flushed_tables(session))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed_tables(orm_execute_state):
+    # INSERT, UPDATE and DELETE statements run by the session: bulk inserts,
+    # Query.update(). Statements with stamp_tables=False execution option
+    # are not stamped: counters written every few seconds would make every
+    # cache of their tables stale, pages show them with a delay of ttl
+    state = orm_execute_state
+
+    if not state.execution_options.get("stamp_tables", True):
+        return
+
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+
+    table = state.statement.table
+
+    if _stamped(table):
+        # The table is stamped by _collect_changed_rows if the statement
+        # changes any row
+        state.update_execution_options(stamp_session=state.session)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _collect_changed_rows(conn, cursor, statement, parameters, context, executemany):
+    session = context.execution_options.get("stamp_session")
+
+    if session is None or not (
+        context.isinsert or context.isupdate or context.isdelete
+    ):
+        return
+
+    # Nothing matched the WHERE of UPDATE or DELETE. Drivers which don't
+    # count rows of executemany give -1
+    if cursor.rowcount != 0:
+        changed = session.info.setdefault("changed_tables", set())
+        changed.add(context.compiled.statement.table.name)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_changed_tables(session):
+    # Pending changes are flushed here to be stamped in the same transaction
+    session.flush()
+    changed = session.info.pop("changed_tables", None)
+
+    if changed:
+        bump_table_versions(session.connection(), changed)
+
+        if has_request_context():
+            g.pop("table_versions", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_tables(session):
+    session.info.pop("changed_tables", None)
+
+
+def bump_table_versions(connection, tables):
+    """Add 1 to change stamps of tables, no commit."""
+    table = TableVersion.__table__
+    dialect_insert = (
+        pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+    )
+
+    # Sorted, so concurrent transactions lock rows in the same order
+    statement = dialect_insert(table).values(
+        [{"table_name": name, "version": 1} for name in sorted(tables)]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.table_name], set_={"version": table.c.version + 1}
+    )
+    connection.execute(statement)
+
+
+def data_version(*tables):
+    """Change stamp of tables: a number which grows with every committed
+    change of their rows made through a session, in any process.
+
+    A cache built from the tables is fresh while the stamp is the same. In a
+    request stamps of all tables are read with one query and kept until the
+    request commits its own changes. Changes made by plain SQL (migrations,
+    sqlite3 shell) and changes of queues and statistics (_stamped) are not
+    stamped.
+    """
+    if has_request_context():
+        versions = g.get("table_versions")
+
+        if versions is None:
+            versions = dict(
+                db.session.query(TableVersion.table_name, TableVersion.version)
+            )
+            g.table_versions = versions
+    else:
+        versions = dict(
+            db.session.query(TableVersion.table_name, TableVersion.version).filter(
+                TableVersion.table_name.in_(tables)
+            )
+        )
+
+    return sum(versions.get(name, 0) for name in tables)
+
+
+def sql_post_ranking_score(upvotes, age, views):
+    # Negative power of a negative number is complex, such posts are ranked
+    # as posts without votes
+    return post_ranking_score(max(upvotes, 0), max(age, 0), views)
+
+
+@event.listens_for(Engine, "connect")
+def register_post_ranking_score(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "post_ranking_score", 3, sql_post_ranking_score, deterministic=True
+        )
+
+
+def sql_post_rank():
+    """SQL expression of post_ranking_score() for Posts. SQLite calls the
+    registered Python function, PostgreSQL computes the formula itself."""
+    if not is_postgresql():
+        age = db.cast(
+            (db.func.julianday("now") - db.func.julianday(Posts.created_on)) * 24,
+            db.Integer,
+        )
+        return db.func.post_ranking_score(Posts.votes, age, Posts.views)
+
+    age = db.func.floor(db.extract("epoch", db.func.now() - Posts.created_on) / 3600)
+    upvotes = db.func.power(db.func.greatest(Posts.votes, 0), 0.8)
+
+    return (
+        upvotes / db.func.power(db.func.greatest(age, 0) + 2, 1.8) / (Posts.views + 1)
+    )
+
+
+def update_post_rank(post_ids=None, window=POST_RANK_WINDOW_HOURS, stamp_tables=True):
+    """Recalculate rank of posts with one UPDATE statement, no commit.
+
+    Only posts younger than window hours are updated, rank of older posts is
+    frozen (it is close to zero and is not changed by the hourly job). With
+    post_ids given the rank of these posts is updated regardless of age,
+    window=None updates all posts. stamp_tables=False leaves the change
+    stamp of posts as it is (rank after new views).
+    """
+    statement = db.update(Posts).values({Posts.rank: sql_post_rank()})
+
+    if post_ids is not None:
+        statement = statement.where(Posts.id.in_(post_ids))
+    elif window is not None:
+        statement = statement.where(
+            Posts.created_on >= datetime.utcnow() - timedelta(hours=window)
+        )
+
+    db.session.execute(
+        statement.execution_options(
+            synchronize_session=False, stamp_tables=stamp_tables
+        )
+    )
+
+
+def recalculate_post_rank(window=POST_RANK_WINDOW_HOURS):
+    update_post_rank(window=window)
     db.session.commit()
 
 
@@ -783,11 +1140,41 @@ def add_mail_notification(user_id, title, content):
     if not Users.query.filter_by(id=user_id).first():
         return
 
-    n = Notification(recipient=user_id, title=title, content=content)
+    n = Notification(
+        recipient=user_id,
+        title=title,
+        content=content,
+        next_attempt_at=datetime.utcnow() + timedelta(seconds=MAIL_DIGEST_WINDOW),
+    )
     db.session.add(n)
     db.session.commit()
 
 
+def add_mail_notifications(user_ids, title, content):
+    """Queue the same mail to many users with one INSERT, the caller commits."""
+    user_ids = [
+        user_id
+        for (user_id,) in db.session.query(Users.id).filter(Users.id.in_(set(user_ids)))
+    ]
+
+    if not user_ids:
+        return
+
+    send_after = datetime.utcnow() + timedelta(seconds=MAIL_DIGEST_WINDOW)
+    db.session.execute(
+        Notification.__table__.insert(),
+        [
+            {
+                "recipient": user_id,
+                "title": title,
+                "content": content,
+                "next_attempt_at": send_after,
+            }
+            for user_id in user_ids
+        ],
+    )
+
+
 def init_db():
     # Data
     users = [
@@ -3009,11 +3396,13 @@ def init_db():
 
     # Check if db file already exists. If so, backup it
     db_file = Path(SQLITE_DATABASE_PATH + SQLITE_DATABASE_NAME)
-    if db_file.is_file():
-        shutil.copyfile(
-            SQLITE_DATABASE_PATH + SQLITE_DATABASE_NAME,
-            SQLITE_DATABASE_PATH + SQLITE_DATABASE_BACKUP_NAME,
-        )
+    if not is_postgresql() and db_file.is_file():
+        # Backup API copies changes still in the WAL file too
+        source = sqlite3.connect(SQLITE_DATABASE_PATH + SQLITE_DATABASE_NAME)
+        backup = sqlite3.connect(SQLITE_DATABASE_PATH + SQLITE_DATABASE_BACKUP_NAME)
+        source.backup(backup)
+        backup.close()
+        source.close()
 
     # Init DB
     db.session.commit()  # https://stackoverflow.com/questions/24289808/drop-all-freezes-in-flask-with-sqlalchemy
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, make_response, request, session
+
+from flask_se_config import (
+    PAGE_CACHE_DIR,
+    PAGE_CACHE_DIR_MAX_BYTES,
+    PAGE_CACHE_MAX_BYTES,
+    PAGE_CACHE_TTL,
+)
+from se_models import data_version
+
+log = logging.getLogger("flask_se.sub")
+
+# Rendered public pages for anonymous visitors. A page is kept by its URL
+# with the change stamp of the tables it is built from (se_models.data_version)
+# and is rendered again when the stamp moves or after ttl seconds. Pages are
+# kept in the memory of the process (least recently used are dropped above
+# PAGE_CACHE_MAX_BYTES) and, with PAGE_CACHE_DIR, in files shared by all
+# processes of the site (the oldest are removed above PAGE_CACHE_DIR_MAX_BYTES).
+#
+# Requests with a session (logged in users, flashed messages, CSRF tokens)
+# or a remember me cookie are not cached, neither are responses which
+# changed the session or set a cookie.
+#
+# Pages and fragments are also sent with an ETag built from the same change
+# stamp, the URL and the visitor, so a browser asking again with
+# If-None-Match gets 304 Not Modified before the view runs.
+
+# Tables the layout of every page reads for a logged in visitor: the name
+# and the menu of the user
+LAYOUT_TABLES = ["users", "staff"]
+
+Page = namedtuple("Page", ["version", "expires", "status", "headers", "body"])
+
+
+class PageCache:
+    def __init__(self, max_bytes, directory=None, directory_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.directory_max_bytes = directory_max_bytes
+
+        self._pages = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self._pruned_at = time.time()
+        self._written = 0
+
+    def get(self, key, version):
+        with self._lock:
+            page = self._pages.get(key)
+
+            if page is not None:
+                self._pages.move_to_end(key)
+
+        if page is None and self.directory:
+            page = self._read(key)
+
+            if page is not None:
+                self._remember(key, page)
+
+        if page is None or page.version != version or page.expires < time.time():
+            return None
+
+        return page
+
+    def put(self, key, page):
+        self._remember(key, page)
+
+        if self.directory:
+            self._write(key, page)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._size = 0
+
+    def _remember(self, key, page):
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._size = self._size - len(old.body)
+
+            self._pages[key] = page
+            self._size = self._size + len(page.body)
+
+            while self._size > self.max_bytes and self._pages:
+                _, old = self._pages.popitem(last=False)
+                self._size = self._size - len(old.body)
+
+    def _path(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest()
+        )
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as file:
+                meta = json.loads(file.readline())
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("key") != key:
+            return None
+
+        return Page(
+            meta["version"],
+            meta["expires"],
+            meta["status"],
+            [tuple(header) for header in meta["headers"]],
+            body,
+        )
+
+    def _write(self, key, page):
+        meta = {
+            "key": key,
+            "version": page.version,
+            "expires": page.expires,
+            "status": page.status,
+            "headers": page.headers,
+        }
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Readers of other processes see either the old or the new file
+            with tempfile.NamedTemporaryFile(
+                "wb", dir=self.directory, prefix=".", delete=False
+            ) as file:
+                file.write(json.dumps(meta).encode("utf-8") + b"\n")
+                file.write(page.body)
+
+            os.replace(file.name, self._path(key))
+        except OSError as err:
+            log.error("Page cache: %s", err)
+            return
+
+        self._prune(len(page.body))
+
+    def _prune(self, written):
+        # Files of expired pages are removed once in PAGE_CACHE_TTL seconds,
+        # and the oldest files when the directory grows above its size. The
+        # size is checked after a tenth of it was written by this process.
+        now = time.time()
+
+        with self._lock:
+            self._written = self._written + written
+
+            if now - self._pruned_at < PAGE_CACHE_TTL and (
+                self.directory_max_bytes is None
+                or self._written < self.directory_max_bytes // 10
+            ):
+                return
+
+            self._pruned_at = now
+            self._written = 0
+
+        files = []
+        size = 0
+
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+
+                if stat.st_mtime < now - PAGE_CACHE_TTL:
+                    os.remove(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    size = size + stat.st_size
+            except OSError:
+                pass
+
+        if self.directory_max_bytes is None:
+            return
+
+        files.sort()
+
+        for _, file_size, path in files:
+            if size <= self.directory_max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            size = size - file_size
+
+
+page_cache = PageCache(PAGE_CACHE_MAX_BYTES, PAGE_CACHE_DIR, PAGE_CACHE_DIR_MAX_BYTES)
+
+
+def anonymous_request():
+    remember_cookie = current_app.config.get("REMEMBER_COOKIE_NAME", "remember_token")
+
+    return (
+        request.method in ("GET", "HEAD")
+        and not session
+        and remember_cookie not in request.cookies
+    )
+
+
+def cacheable_response(response):
+    return (
+        response.status_code == 200
+        and not response.direct_passthrough
+        and not session.modified
+        and not session
+        and "Set-Cookie" not in response.headers
+    )
+
+
+def page_visitor():
+    """Parts of the session a page depends on: the user and the CSRF token of
+    the forms."""
+    return [session.get("_user_id"), session.get("csrf_token")]
+
+
+def page_etag(tables, ttl, visitor):
+    """Strong ETag of the page of the request. It is the same while the data
+    of the tables, the URL and the visitor are the same, but not longer than
+    ttl seconds: pages show relative times. Pages of a logged in visitor
+    also depend on LAYOUT_TABLES."""
+    if visitor[0] is not None:
+        tables = list(tables) + LAYOUT_TABLES
+
+    source = [data_version(*tables), int(time.time() // ttl), request.url, visitor]
+
+    return hashlib.sha1(json.dumps(source).encode("utf-8")).hexdigest()
+
+
+def conditional_page(tables, ttl=PAGE_CACHE_TTL):
+    """Send the page of the view with an ETag and answer If-None-Match with
+    304 Not Modified without running the view, tables are names of tables
+    the page is built from."""
+
+    def decorator(view):
+        @wraps(view)
+        def conditional_view(*args, **kwargs):
+            # A flashed message is shown once, the page must be rendered
+            if request.method not in ("GET", "HEAD") or "_flashes" in session:
+                return view(*args, **kwargs)
+
+            visitor = page_visitor()
+            etag = page_etag(tables, ttl, visitor)
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+
+                # The view logged the user in or out or made a CSRF token
+                if response.status_code != 200 or page_visitor() != visitor:
+                    return response
+
+            # Browsers ask again every time, with If-None-Match
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            if session:
+                response.cache_control.private = True
+
+            return response
+
+        return conditional_view
+
+    return decorator
+
+
+def cached_page(tables, ttl=PAGE_CACHE_TTL):
+    """Keep the page rendered by the view for anonymous visitors and send it
+    with an ETag (conditional_page), tables are names of tables the page is
+    built from."""
+
+    def decorator(view):
+        @wraps(view)
+        def cached_view(*args, **kwargs):
+            if not anonymous_request():
+                return view(*args, **kwargs)
+
+            key = request.url
+            version = data_version(*tables)
+            page = page_cache.get(key, version)
+
+            if page is None:
+                response = make_response(view(*args, **kwargs))
+
+                if not cacheable_response(response):
+                    return response
+
+                page = Page(
+                    version,
+                    time.time() + ttl,
+                    response.status_code,
+                    [
+                        (name, value)
+                        for name, value in response.headers
+                        if name != "Content-Length"
+                    ],
+                    response.get_data(),
+                )
+                page_cache.put(key, page)
+
+            return current_app.response_class(
+                page.body, status=page.status, headers=page.headers
+            )
+
+        return conditional_page(tables, ttl)(cached_view)
+
+    return decorator
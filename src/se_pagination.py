@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import binascii
+import json
+
+from flask import request, url_for
+from sqlalchemy import and_, or_, tuple_
+
+# Keyset (cursor) pagination for fetch_* endpoints. Instead of COUNT(*) and
+# OFFSET a page is selected by "key < key of the last row of previous page",
+# so every page costs the same. Total is optional and counted only up to
+# KEYSET_TOTAL_LIMIT rows on the first page.
+KEYSET_TOTAL_LIMIT = 1000
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, total=None, total_is_exact=True):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_is_exact = total_is_exact
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def next_url(self):
+        if not self.has_next:
+            return None
+
+        args = request.args.to_dict()
+        args["cursor"] = self.next_cursor
+        args.pop("total", None)
+        return url_for(request.endpoint, **args)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def cursor_value_fits(column, value):
+    """True if a value of the cursor can be compared with the column: a
+    number for a number column, a string for a string column, or null."""
+    if value is None:
+        return True
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return False
+
+    if python_type is float:
+        python_type = (int, float)
+
+    if isinstance(value, bool) and python_type is not bool:
+        return False
+
+    return isinstance(value, python_type)
+
+
+def decode_cursor(cursor, order_by):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+    if not isinstance(values, list) or len(values) != len(order_by):
+        return None
+
+    for (column, descending), value in zip(order_by, values):
+        if not cursor_value_fits(column, value):
+            return None
+
+    return values
+
+
+def keyset_filter(order_by, values):
+    columns = [column for column, descending in order_by]
+    directions = {descending for column, descending in order_by}
+
+    # Row value comparison lets SQLite use index on the key columns
+    if directions == {True}:
+        return tuple_(*columns) < tuple_(*values)
+    if directions == {False}:
+        return tuple_(*columns) > tuple_(*values)
+
+    conditions = []
+    for i, (column, descending) in enumerate(order_by):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        if descending:
+            conditions.append(and_(*equal, column < values[i]))
+        else:
+            conditions.append(and_(*equal, column > values[i]))
+
+    return or_(*conditions)
+
+
+def keyset_paginate(query, order_by, cursor, per_page=10, with_total=False):
+    """Select one page of query after cursor.
+
+    order_by is a list of (column, descending) pairs, the last column must be
+    unique (id). Empty or broken cursor means the first page.
+    """
+    values = decode_cursor(cursor, order_by) if cursor else None
+    query = query.order_by(None)
+
+    total = None
+    total_is_exact = True
+    if with_total and values is None:
+        total = query.limit(KEYSET_TOTAL_LIMIT).count()
+        total_is_exact = total < KEYSET_TOTAL_LIMIT
+
+    if values is not None:
+        query = query.filter(keyset_filter(order_by, values))
+
+    query = query.order_by(
+        *[
+            column.desc() if descending else column.asc()
+            for column, descending in order_by
+        ]
+    )
+    items = query.limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(
+            [getattr(items[-1], column.key) for column, descending in order_by]
+        )
+
+    return KeysetPage(items, next_cursor, total, total_is_exact)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from types import MappingProxyType
+
+from sqlalchemy import inspect
+
+from se_cache import TableCache
+from se_models import (
+    db,
+    AreasOfStudy,
+    Company,
+    Courses,
+    InternshipCompany,
+    InternshipFormat,
+    InternshipTag,
+    PostType,
+    ThemesLevel,
+    ThesisOnReviewWorktype,
+    Worktype,
+)
+
+# Small lookup tables are read on many pages for filters, form choices and
+# input checks. Each of them is kept in memory as a read-only map
+# id -> record, a named tuple with the columns of the table, and is loaded
+# again after a commit which changed the table (se_cache.TableCache).
+# Records are not ORM objects: relationships (theme.levels) still need
+# model instances from a query.
+
+
+def _model_str(model):
+    if model.__str__ is not object.__str__:
+        return model.__str__
+
+    # Model.__repr__ of Flask-SQLAlchemy needs an ORM object
+    if model.__repr__ is not db.Model.__repr__:
+        return model.__repr__
+
+    return None
+
+
+def record_type(model):
+    """Named tuple with the columns of the model, printed the same way as
+    model instances ({{ area }} in templates)."""
+    columns = [attr.key for attr in inspect(model).column_attrs]
+    fields = namedtuple(model.__name__ + "Record", columns)
+
+    namespace = {"__slots__": ()}
+    if _model_str(model) is not None:
+        namespace["__str__"] = _model_str(model)
+
+    return type(fields.__name__, (fields,), namespace)
+
+
+class ReferenceTable:
+    def __init__(self, model, ttl=300):
+        self.model = model
+        self.record = record_type(model)
+        self.columns = list(self.record._fields)
+
+        self.cache = TableCache(self.load, [model.__tablename__], ttl=ttl)
+
+    def load(self):
+        rows = db.session.query(
+            *[getattr(self.model, name) for name in self.columns]
+        ).order_by(self.model.id)
+
+        return MappingProxyType({row.id: self.record(*row) for row in rows})
+
+    def all(self):
+        """Records ordered by id."""
+        return tuple(self.cache.get().values())
+
+    def get(self, record_id, default=None):
+        return self.cache.get().get(record_id, default)
+
+    def __contains__(self, record_id):
+        return record_id in self.cache.get()
+
+    def __len__(self):
+        return len(self.cache.get())
+
+
+worktypes = ReferenceTable(Worktype)
+thesis_on_review_worktypes = ReferenceTable(ThesisOnReviewWorktype)
+courses = ReferenceTable(Courses)
+areas_of_study = ReferenceTable(AreasOfStudy)
+themes_levels = ReferenceTable(ThemesLevel)
+companies = ReferenceTable(Company)
+internship_formats = ReferenceTable(InternshipFormat)
+internship_tags = ReferenceTable(InternshipTag)
+internship_companies = ReferenceTable(InternshipCompany)
+post_types = ReferenceTable(PostType)
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, func, literal_column, table, column, select, case
+
+from se_models import db, is_postgresql, Thesis, ThesisText
+
+# Full text search over theses is done by a SQLite FTS5 virtual table.
+# The table is an external content index on the "thesis_fts_content" view
+# (thesis metadata joined with thesis_text) and is kept in step with both
+# tables by triggers, so every writer (site, scripts, admin) updates it.
+#
+# In PostgreSQL "thesis_fts" is a table of tsvector documents with a GIN
+# index. A document is built by the "thesis_fts_content" view and the table
+# is kept in step by triggers in the same way.
+THESIS_FTS_TABLE = "thesis_fts"
+THESIS_FTS_COLUMNS = ["name_ru", "description", "author", "text"]
+
+# bm25() weights, in the order of THESIS_FTS_COLUMNS
+THESIS_FTS_WEIGHTS = [10.0, 5.0, 10.0, 1.0]
+
+# PostgreSQL: weight label of each column in the document and ts_rank()
+# weights of labels {D, C, B, A}, in the same ratio as THESIS_FTS_WEIGHTS
+THESIS_FTS_LABELS = {"name_ru": "A", "description": "B", "author": "A", "text": "D"}
+THESIS_FTS_RANK_WEIGHTS = "{0.1, 0.2, 0.5, 1.0}"
+
+# A hit in one of these columns ranks above a hit in the text only
+THESIS_FTS_TITLE_COLUMNS = ["name_ru", "description", "author"]
+THESIS_FTS_BODY_COLUMNS = ["text"]
+
+# Context shown under a search hit: one fragment of the text per search
+# term, each fragment is built by snippet() (ts_headline() in PostgreSQL)
+# inside the database
+SEARCH_SNIPPET_TOKENS = 24
+SEARCH_SNIPPETS_PER_THESIS = 3
+_snippet_open = "\x02"
+_snippet_close = "\x03"
+
+thesis_fts = table(THESIS_FTS_TABLE, column("rowid"), *map(column, THESIS_FTS_COLUMNS))
+thesis_fts_document = table(THESIS_FTS_TABLE, column("thesis_id"), column("document"))
+
+_search_term_re = re.compile(r"[\w*?]+")
+
+sqlite_search_index_ddl = [
+    """
+    CREATE VIEW thesis_fts_content AS
+    SELECT thesis.id AS id, thesis.name_ru AS name_ru,
+           thesis.description AS description, thesis.author AS author,
+           thesis_text.text AS text
+    FROM thesis LEFT JOIN thesis_text ON thesis_text.thesis_id = thesis.id
+    """,
+    """
+    CREATE VIRTUAL TABLE thesis_fts USING fts5(
+        name_ru, description, author, text,
+        content='thesis_fts_content', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ai AFTER INSERT ON thesis BEGIN
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = new.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_ad AFTER DELETE ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = old.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_fts_au AFTER UPDATE OF name_ru, description, author
+    ON thesis BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        VALUES ('delete', old.id, old.name_ru, old.description, old.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = old.id));
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        VALUES (new.id, new.name_ru, new.description, new.author,
+                (SELECT text FROM thesis_text WHERE thesis_id = new.id));
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_ai AFTER INSERT ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, NULL
+        FROM thesis WHERE id = new.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, new.text
+        FROM thesis WHERE id = new.thesis_id;
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_ad AFTER DELETE ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, old.text
+        FROM thesis WHERE id = old.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, NULL
+        FROM thesis WHERE id = old.thesis_id;
+    END
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_au AFTER UPDATE OF text ON thesis_text BEGIN
+        INSERT INTO thesis_fts(thesis_fts, rowid, name_ru, description, author, text)
+        SELECT 'delete', id, name_ru, description, author, old.text
+        FROM thesis WHERE id = old.thesis_id;
+        INSERT INTO thesis_fts(rowid, name_ru, description, author, text)
+        SELECT id, name_ru, description, author, new.text
+        FROM thesis WHERE id = new.thesis_id;
+    END
+    """,
+]
+
+sqlite_search_index_drop_ddl = [
+    "DROP TRIGGER IF EXISTS thesis_text_fts_au",
+    "DROP TRIGGER IF EXISTS thesis_text_fts_ad",
+    "DROP TRIGGER IF EXISTS thesis_text_fts_ai",
+    "DROP TRIGGER IF EXISTS thesis_fts_au",
+    "DROP TRIGGER IF EXISTS thesis_fts_ad",
+    "DROP TRIGGER IF EXISTS thesis_fts_ai",
+    "DROP TABLE IF EXISTS thesis_fts",
+    "DROP VIEW IF EXISTS thesis_fts_content",
+]
+
+postgresql_search_index_ddl = [
+    """
+    CREATE VIEW thesis_fts_content AS
+    SELECT thesis.id AS id,
+           setweight(to_tsvector('simple', coalesce(thesis.name_ru, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(thesis.author, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(thesis.description, '')), 'B') ||
+           setweight(to_tsvector('simple', coalesce(thesis_text.text, '')), 'D')
+           AS document
+    FROM thesis LEFT JOIN thesis_text ON thesis_text.thesis_id = thesis.id
+    """,
+    """
+    CREATE TABLE thesis_fts (
+        thesis_id integer PRIMARY KEY REFERENCES thesis (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_thesis_fts_document ON thesis_fts USING gin (document)",
+    """
+    CREATE FUNCTION thesis_fts_refresh(refresh_id integer) RETURNS void AS $$
+        DELETE FROM thesis_fts WHERE thesis_id = refresh_id;
+        INSERT INTO thesis_fts (thesis_id, document)
+        SELECT id, document FROM thesis_fts_content WHERE id = refresh_id;
+    $$ LANGUAGE SQL
+    """,
+    """
+    CREATE FUNCTION thesis_fts_thesis_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM thesis_fts_refresh(NEW.id);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER thesis_fts_aiu
+    AFTER INSERT OR UPDATE OF name_ru, description, author ON thesis
+    FOR EACH ROW EXECUTE PROCEDURE thesis_fts_thesis_changed()
+    """,
+    """
+    CREATE FUNCTION thesis_fts_text_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM thesis_fts_refresh(OLD.thesis_id);
+        ELSE
+            PERFORM thesis_fts_refresh(NEW.thesis_id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER thesis_text_fts_aiud
+    AFTER INSERT OR UPDATE OF text OR DELETE ON thesis_text
+    FOR EACH ROW EXECUTE PROCEDURE thesis_fts_text_changed()
+    """,
+]
+
+postgresql_search_index_drop_ddl = [
+    "DROP TRIGGER IF EXISTS thesis_text_fts_aiud ON thesis_text",
+    "DROP TRIGGER IF EXISTS thesis_fts_aiu ON thesis",
+    "DROP FUNCTION IF EXISTS thesis_fts_text_changed()",
+    "DROP FUNCTION IF EXISTS thesis_fts_thesis_changed()",
+    "DROP FUNCTION IF EXISTS thesis_fts_refresh(integer)",
+    "DROP TABLE IF EXISTS thesis_fts",
+    "DROP VIEW IF EXISTS thesis_fts_content",
+]
+
+# By database dialect
+search_index_ddl = {
+    "sqlite": sqlite_search_index_ddl,
+    "postgresql": postgresql_search_index_ddl,
+}
+search_index_drop_ddl = {
+    "sqlite": sqlite_search_index_drop_ddl,
+    "postgresql": postgresql_search_index_drop_ddl,
+}
+search_index_rebuild = {
+    "sqlite": "INSERT INTO thesis_fts(thesis_fts) VALUES ('rebuild')",
+    "postgresql": "INSERT INTO thesis_fts (thesis_id, document) "
+    "SELECT id, document FROM thesis_fts_content",
+}
+
+# Create the index together with the tables (init_db), "thesis_text" is
+# created after and dropped before "thesis"
+for dialect in search_index_ddl:
+    for statement in search_index_ddl[dialect]:
+        event.listen(
+            ThesisText.__table__,
+            "after_create",
+            DDL(statement).execute_if(dialect=dialect),
+        )
+
+    for statement in search_index_drop_ddl[dialect]:
+        event.listen(
+            ThesisText.__table__,
+            "before_drop",
+            DDL(statement).execute_if(dialect=dialect),
+        )
+
+
+def create_search_index(connection=None):
+    """(Re)create search index in an existing database and fill it.
+
+    The application database is used if connection is not given.
+    """
+    if connection is None:
+        with db.engine.begin() as connection:
+            return create_search_index(connection)
+
+    dialect = connection.dialect.name
+
+    for statement in search_index_drop_ddl[dialect] + search_index_ddl[dialect]:
+        connection.exec_driver_sql(statement)
+
+    connection.exec_driver_sql(search_index_rebuild[dialect])
+
+
+def make_match_terms(search):
+    """Convert user input into list of FTS5 terms (tsquery terms in
+    PostgreSQL).
+
+    Every word becomes a quoted term. A word with "*" or "?" inside is
+    turned into a prefix query up to the first wildcard: "Макс*" -> "Макс"*
+    ('Макс':* in PostgreSQL).
+    """
+    postgresql = is_postgresql()
+    terms = []
+
+    for word in _search_term_re.findall(search):
+        word = word.lstrip("*?")
+        wildcard = re.search(r"[*?]", word)
+
+        if wildcard:
+            word = word[: wildcard.start()]
+
+        if not word:
+            continue
+
+        if postgresql:
+            terms.append("'" + word + "'" + (":*" if wildcard else ""))
+        elif wildcard:
+            terms.append('"' + word + '"*')
+        else:
+            terms.append('"' + word + '"')
+
+    return terms
+
+
+def make_match_query(search):
+    """Convert user input into FTS5 MATCH expression (tsquery in PostgreSQL),
+    terms are combined with AND. Returns None if there is nothing to search."""
+    terms = make_match_terms(search)
+
+    if not terms:
+        return None
+
+    if is_postgresql():
+        return " & ".join(terms)
+
+    return " ".join(terms)
+
+
+def search_match(match_query):
+    if is_postgresql():
+        return thesis_fts_document.c.document.op("@@")(
+            func.to_tsquery("simple", match_query)
+        )
+
+    return literal_column(THESIS_FTS_TABLE).op("MATCH")(match_query)
+
+
+def search_hit(columns, match_query):
+    """True for theses matching FTS5 expression in one of the columns."""
+    if is_postgresql():
+        # Only lexemes of the columns' labels, thesis_fts is joined
+        labels = sorted(set(THESIS_FTS_LABELS[name].lower() for name in columns))
+        document = func.ts_filter(
+            thesis_fts_document.c.document, "{" + ",".join(labels) + "}"
+        )
+        return document.op("@@")(func.to_tsquery("simple", match_query))
+
+    column_query = "{" + " ".join(columns) + "} : (" + match_query + ")"
+
+    return Thesis.id.in_(
+        select(thesis_fts.c.rowid)
+        .where(search_match(column_query))
+        .correlate(None)
+        .scalar_subquery()
+    )
+
+
+def search_rank(match_query):
+    """Order by relevance: title and text hit, title hit, text hit.
+
+    Inside each group records are ordered by bm25() which is negative,
+    the better match the lower value (by ts_rank() in PostgreSQL).
+    """
+    title_hit = search_hit(THESIS_FTS_TITLE_COLUMNS, match_query)
+    body_hit = search_hit(THESIS_FTS_BODY_COLUMNS, match_query)
+
+    priority = case(
+        (title_hit & body_hit, 0),
+        (title_hit, 1),
+        else_=2,
+    )
+
+    if is_postgresql():
+        return [
+            priority,
+            -func.ts_rank(
+                THESIS_FTS_RANK_WEIGHTS,
+                thesis_fts_document.c.document,
+                func.to_tsquery("simple", match_query),
+            ),
+        ]
+
+    return [
+        priority,
+        func.bm25(literal_column(THESIS_FTS_TABLE), *THESIS_FTS_WEIGHTS),
+    ]
+
+
+def search_theses(query, match_query):
+    """Restrict Thesis query to records matching FTS5 expression.
+
+    Filters of the query are applied in the same SQL statement, the whole
+    result is ranked by search_rank() so pagination goes after ranking.
+    """
+    if is_postgresql():
+        query = query.join(
+            thesis_fts_document, thesis_fts_document.c.thesis_id == Thesis.id
+        )
+    else:
+        query = query.join(thesis_fts, thesis_fts.c.rowid == Thesis.id)
+
+    return query.filter(search_match(match_query)).order_by(*search_rank(match_query))
+
+
+def _snippet_markup(fragment):
+    return Markup(
+        escape(fragment)
+        .replace(_snippet_open, Markup("<mark>"))
+        .replace(_snippet_close, Markup("</mark>"))
+    )
+
+
+def _snippet_records(thesis_ids, term):
+    snippet = func.snippet(
+        literal_column(THESIS_FTS_TABLE),
+        THESIS_FTS_COLUMNS.index("text"),
+        _snippet_open,
+        _snippet_close,
+        "…",
+        SEARCH_SNIPPET_TOKENS,
+    )
+
+    return (
+        db.session.query(thesis_fts.c.rowid, snippet)
+        .filter(search_match("{text} : " + term))
+        .filter(thesis_fts.c.rowid.in_(thesis_ids))
+    )
+
+
+def _headline_records(thesis_ids, term):
+    options = (
+        'StartSel="%s", StopSel="%s", MaxWords=%d, MinWords=%d, MaxFragments=1'
+        % (
+            _snippet_open,
+            _snippet_close,
+            SEARCH_SNIPPET_TOKENS,
+            SEARCH_SNIPPET_TOKENS // 2,
+        )
+    )
+    headline = func.ts_headline(
+        "simple", ThesisText.text, func.to_tsquery("simple", term), options
+    )
+
+    return (
+        db.session.query(ThesisText.thesis_id, func.concat("…", headline, "…"))
+        .join(
+            thesis_fts_document, thesis_fts_document.c.thesis_id == ThesisText.thesis_id
+        )
+        .filter(search_hit(THESIS_FTS_BODY_COLUMNS, term))
+        .filter(ThesisText.thesis_id.in_(thesis_ids))
+    )
+
+
+def search_snippets(thesis_ids, search):
+    """Highlighted fragments of the text for each of the theses.
+
+    Returns {thesis_id: [fragment, ...]}, up to SEARCH_SNIPPETS_PER_THESIS
+    fragments per thesis. Only matched theses get an entry.
+    """
+    snippets = {}
+
+    if not thesis_ids:
+        return snippets
+
+    for term in make_match_terms(search):
+        if is_postgresql():
+            records = _headline_records(thesis_ids, term)
+        else:
+            records = _snippet_records(thesis_ids, term)
+
+        for thesis_id, fragment in records:
+            fragments = snippets.setdefault(thesis_id, [])
+            fragment = _snippet_markup(fragment)
+
+            if (
+                len(fragments) < SEARCH_SNIPPETS_PER_THESIS
+                and fragment not in fragments
+            ):
+                fragments.append(fragment)
+
+    return snippets
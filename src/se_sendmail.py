@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import logging
 import smtplib, ssl
+import uuid
+from datetime import datetime, timedelta
 
 from se_models import db, Notification, Users, DiplomaThemes
 from flask_se_config import MAIL_PASSWORD
@@ -8,69 +11,308 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import Header
 
+log = logging.getLogger("flask_se.sub")
+
 MAIL_DEFAULT_SENDER = "sysprog_notification@spbu.ru"
 MAIL_DEFAULT_SENDER_STRING = "SE уведомления <sysprog_notification@spbu.ru>"
 
+MAIL_SERVER = "mail.spbu.ru"
+MAIL_PORT = 25
+MAIL_TIMEOUT = 30
 
-def notification_send_mail():
-    notifications = Notification.query.filter_by(type=0).all()
+# Notifications sent by one run of notification_send_mail and messages sent
+# over one SMTP connection
+MAIL_BATCH = 200
+MAIL_MESSAGES_PER_CONNECTION = 100
+
+# Claimed notification is returned to the queue if it is not sent in
+# MAIL_LEASE_SECONDS. Failed one is retried after MAIL_RETRY_DELAY seconds,
+# the delay is doubled with every attempt, after MAIL_MAX_ATTEMPTS it stays
+# in the table as dead (status 2) with the last error.
+MAIL_LEASE_SECONDS = 600
+MAIL_RETRY_DELAY = 60
+MAIL_MAX_ATTEMPTS = 8
 
-    for n in notifications:
-        user = Users.query.filter_by(id=n.recipient).first()
 
-        if not user:
-            continue
+class MailSender:
+    """One SMTP connection for many messages.
 
-        message = MIMEMultipart("alternative")
-        message["Subject"] = n.title
-        message["From"] = MAIL_DEFAULT_SENDER
-        message["To"] = user.email
+    Connection is opened and authenticated on the first message, reused for
+    the next ones and reopened if the server drops it or after
+    MAIL_MESSAGES_PER_CONNECTION messages. Use as a context manager so the
+    connection is closed with QUIT.
 
-        part1 = MIMEText(n.content, "plain")
-        part2 = MIMEText(n.content, "html")
+    Errors of the greeting and of the login are logged and raised, nothing
+    can be sent over such a connection.
+    """
 
-        message.attach(part1)
-        message.attach(part2)
+    def __init__(self, host=None, port=None):
+        self.host = host or MAIL_SERVER
+        self.port = port or MAIL_PORT
+        self.server = None
+        self.sent = 0
 
-        server = smtplib.SMTP("mail.spbu.ru", 25)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        self.close()
+        self.server = smtplib.SMTP(self.host, self.port, timeout=MAIL_TIMEOUT)
+        self.sent = 0
 
         try:
-            server.ehlo()
-            server.login(MAIL_DEFAULT_SENDER, MAIL_PASSWORD)
+            self.server.ehlo()
+            self.server.login(MAIL_DEFAULT_SENDER, MAIL_PASSWORD)
 
         except smtplib.SMTPHeloError:
-            print("The server didn’t reply properly to the HELO greeting.")
+            log.error("The server didn’t reply properly to the HELO greeting.")
+            self.close()
+            raise
         except smtplib.SMTPAuthenticationError:
-            print(
-                "The server didn’t accept the username/password combination. Username:"
-                + MAIL_DEFAULT_SENDER
-                + ", PASS:"
-                + MAIL_PASSWORD
+            log.error(
+                "The server didn’t accept the username/password combination. Username: %s",
+                MAIL_DEFAULT_SENDER,
             )
+            self.close()
+            raise
         except smtplib.SMTPNotSupportedError:
-            print("The AUTH command is not supported by the server.")
+            log.error("The AUTH command is not supported by the server.")
+            self.close()
+            raise
         except smtplib.SMTPException:
-            print("No suitable authentication method was found.")
+            log.error("No suitable authentication method was found.")
+            self.close()
+            raise
+
+    def close(self):
+        if self.server is None:
+            return
+
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+
+        self.server = None
+
+    def send(self, recipients, message):
+        """Send message, reconnect once if the connection is lost.
+
+        SMTP errors about the message itself (refused recipient or sender) are
+        raised to the caller, connection stays usable.
+        """
+        if self.server is None or self.sent >= MAIL_MESSAGES_PER_CONNECTION:
+            self.connect()
+
+        try:
+            self.server.sendmail(MAIL_DEFAULT_SENDER, recipients, message.as_string())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.connect()
+            self.server.sendmail(MAIL_DEFAULT_SENDER, recipients, message.as_string())
+
+        self.sent = self.sent + 1
+
+
+def make_message(subject, content, to):
+    message = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"] = MAIL_DEFAULT_SENDER
+    message["To"] = to
+
+    # utf-8 parts are base64 encoded, long lines of a digest are safe
+    part1 = MIMEText(content, "plain", "utf-8")
+    part2 = MIMEText(content, "html", "utf-8")
+
+    message.attach(part1)
+    message.attach(part2)
+
+    return message
+
+
+def notification_claimable(now):
+    return (Notification.type == 0) & (
+        (
+            (Notification.status == 0)
+            & (
+                (Notification.next_attempt_at == None)
+                | (Notification.next_attempt_at <= now)
+            )
+        )
+        | ((Notification.status == 1) & (Notification.lease_until < now))
+    )
+
+
+def claim_notifications(limit=None):
+    """Claim up to limit notifications ready to be sent.
+
+    Notifications are leased by one UPDATE, so each of them goes to one
+    worker even if notification_send_mail runs in several processes. A lease
+    of a crashed worker expires after MAIL_LEASE_SECONDS.
+    """
+    now = datetime.utcnow()
+    owner = uuid.uuid4().hex
+
+    ready = (
+        db.session.query(Notification.id)
+        .filter(notification_claimable(now))
+        .order_by(Notification.id)
+        .limit(limit or MAIL_BATCH)
+        .scalar_subquery()
+    )
+
+    lease = {
+        Notification.status: 1,
+        Notification.lease_owner: owner,
+        Notification.lease_until: now + timedelta(seconds=MAIL_LEASE_SECONDS),
+    }
+
+    # Condition is checked again by UPDATE for rows claimed meanwhile
+    Notification.query.filter(Notification.id.in_(ready)).filter(
+        notification_claimable(now)
+    ).update(lease, synchronize_session=False)
+
+    # New notifications to the same recipients go to the digest even if
+    # their window is not over yet
+    recipients = (
+        db.session.query(Notification.recipient)
+        .filter_by(lease_owner=owner)
+        .scalar_subquery()
+    )
+    Notification.query.filter_by(type=0, status=0, attempts=0).filter(
+        Notification.recipient.in_(recipients)
+    ).update(lease, synchronize_session=False)
+
+    db.session.commit()
+
+    notifications = (
+        Notification.query.filter_by(lease_owner=owner, status=1)
+        .order_by(Notification.id)
+        .all()
+    )
+
+    return owner, notifications
+
+
+def notification_failed(n, error):
+    n.attempts = n.attempts + 1
+    n.last_error = str(error)[:1024]
+    n.lease_owner = None
+    n.lease_until = None
 
+    if n.attempts >= MAIL_MAX_ATTEMPTS:
+        n.status = 2
+    else:
+        n.status = 0
+        n.next_attempt_at = datetime.utcnow() + timedelta(
+            seconds=MAIL_RETRY_DELAY * 2 ** (n.attempts - 1)
+        )
+
+
+def notification_release(n):
+    n.status = 0
+    n.lease_owner = None
+    n.lease_until = None
+
+
+def make_digest(notifications):
+    """One message with all notifications to a recipient."""
+    if len(notifications) == 1:
+        return notifications[0].title, notifications[0].content
+
+    title = "[SE site] Новые уведомления ({0})".format(len(notifications))
+    content = "<br><hr>\n".join(
+        "<h4>{0}</h4>{1}".format(
+            n.title.replace("[SE site] ", "", 1) if n.title else "", n.content or ""
+        )
+        for n in notifications
+    )
+
+    return title, content
+
+
+def notification_send_mail(host=None, port=None):
+    """Send claimed notifications, a digest to each recipient, through the
+    SMTP server host:port (MAIL_SERVER:MAIL_PORT by default)."""
+    owner, notifications = claim_notifications()
+
+    if not notifications:
+        return
+
+    users = Users.query.filter(Users.id.in_({n.recipient for n in notifications})).all()
+    emails = {user.id: user.email for user in users}
+
+    digests = {}
+    for n in notifications:
+        digests.setdefault(n.recipient, []).append(n)
+
+    done = []
+    with MailSender(host, port) as sender:
         try:
-            server.sendmail(MAIL_DEFAULT_SENDER, user.email, message.as_string())
-            db.session.delete(n)
+            sender.connect()
+        except (smtplib.SMTPException, OSError):
+            # Nothing is sent, the notifications wait for the next run
+            for n in notifications:
+                notification_release(n)
             db.session.commit()
+            raise
 
-        except smtplib.SMTPRecipientsRefused:
-            print(
-                "All recipients were refused. Nobody got the mail. User.email: {0}".format(
-                    user.email
+        for i, (recipient, digest) in enumerate(digests.items()):
+            email = emails.get(recipient)
+
+            # Notifications of deleted users are dropped
+            if not email:
+                done.extend(n.id for n in digest)
+                continue
+
+            title, content = make_digest(digest)
+            message = make_message(title, content, email)
+            error = None
+
+            try:
+                sender.send(email, message)
+                done.extend(n.id for n in digest)
+
+            except smtplib.SMTPRecipientsRefused as err:
+                print(
+                    "All recipients were refused. Nobody got the mail. User.email: {0}".format(
+                        email
+                    )
                 )
-            )
-        except smtplib.SMTPDataError:
-            print("The server didn’t accept the from_addr.")
-        except smtplib.SMTPSenderRefused:
-            print("The server didn’t accept the from_addr.")
-        except smtplib.SMTPNotSupportedError:
-            print(
-                "SMTPUTF8 was given in the mail_options but is not supported by the server."
-            )
+                error = err
+            except smtplib.SMTPDataError as err:
+                print("The server didn’t accept the from_addr.")
+                error = err
+            except smtplib.SMTPSenderRefused as err:
+                print("The server didn’t accept the from_addr.")
+                error = err
+            except smtplib.SMTPNotSupportedError as err:
+                print(
+                    "SMTPUTF8 was given in the mail_options but is not supported by the server."
+                )
+                error = err
+            except (smtplib.SMTPException, OSError) as err:
+                # Server is not available, the rest is sent next time
+                print("Can't send mail: {0}".format(err))
+                for n in digest:
+                    notification_failed(n, err)
+                for rest in list(digests.values())[i + 1 :]:
+                    for n in rest:
+                        notification_release(n)
+                break
+
+            if error:
+                for n in digest:
+                    notification_failed(n, error)
+
+    if done:
+        Notification.query.filter(Notification.id.in_(done)).filter_by(
+            lease_owner=owner
+        ).delete(synchronize_session=False)
+
+    db.session.commit()
 
 
 def notification_send_diploma_themes_on_review():
@@ -91,45 +333,22 @@ def notification_send_diploma_themes_on_review():
         "stanislav.sartasov@gmail.com",
     ]
 
-    message = MIMEMultipart("alternative")
-    message["Subject"] = "[SE site] Есть неодобренные темы учебных практик и ВКР"
-    message["From"] = MAIL_DEFAULT_SENDER
-    message["To"] = "ilya@hackerdom.ru"
-    message["CC"] = ", ".join(recipients)
-
     data = """
     Сейчас на сайте {0} тем находятся на проверке (<a href="https://se.math.spbu.ru/admin/reviewdiplomathemes/" target="_blank">Проверка тем</a>).
     """.format(
         diploma_themes_on_review_count
     )
 
-    part1 = MIMEText(data, "plain")
-    part2 = MIMEText(data, "html")
-    message.attach(part1)
-    message.attach(part2)
-
-    server = smtplib.SMTP("mail.spbu.ru", 25)
-
-    try:
-        server.ehlo()
-        server.login(MAIL_DEFAULT_SENDER, MAIL_PASSWORD)
-
-    except smtplib.SMTPHeloError:
-        print("The server didn’t reply properly to the HELO greeting.")
-    except smtplib.SMTPAuthenticationError:
-        print(
-            "The server didn’t accept the username/password combination. Username:"
-            + MAIL_DEFAULT_SENDER
-            + ", PASS:"
-            + MAIL_PASSWORD
-        )
-    except smtplib.SMTPNotSupportedError:
-        print("The AUTH command is not supported by the server.")
-    except smtplib.SMTPException:
-        print("No suitable authentication method was found.")
+    message = make_message(
+        "[SE site] Есть неодобренные темы учебных практик и ВКР",
+        data,
+        "ilya@hackerdom.ru",
+    )
+    message["CC"] = ", ".join(recipients)
 
     try:
-        server.sendmail(MAIL_DEFAULT_SENDER, recipients, message.as_string())
+        with MailSender() as sender:
+            sender.send(recipients, message)
 
     except smtplib.SMTPRecipientsRefused:
         print("All recipients were refused. Nobody got the mail.")
@@ -141,3 +360,5 @@ def notification_send_diploma_themes_on_review():
         print(
             "SMTPUTF8 was given in the mail_options but is not supported by the server."
         )
+    except (smtplib.SMTPException, OSError) as err:
+        print("Can't send mail: {0}".format(err))